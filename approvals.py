@@ -0,0 +1,299 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Optional
+from pyrogram import Client
+from pyrogram.errors import FloodWait, BotMethodInvalid, ChatAdminRequired, RPCError
+from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from config import APPROVED, START_PIC, APPROVAL_RATE, APPROVAL_BATCH_SIZE, WELCOME_LINK_REFRESH
+from config import CHAT_ID, USER_SESSION, APP_ID, API_HASH
+from database.database import incr_stat, get_welcome_link, save_welcome_link, delete_welcome_link, get_chat_infos, iter_channels
+from database.database import is_approval_off
+from helper_func import TokenBucket, LatencyTracker
+
+MAX_APPROVE_ATTEMPTS = 3
+
+
+class ApprovalQueue:
+    """Delayed join-request approvals.
+
+    Requests wait in a min-heap keyed by due time instead of parking one
+    handler per request in asyncio.sleep. Due requests are drained per chat in
+    batches under a shared rate limiter.
+    """
+
+    def __init__(self):
+        self.bucket = TokenBucket(APPROVAL_RATE)
+        self.latency = LatencyTracker()
+        self.approved = 0
+        self.failed = 0
+        self._heap = []
+        self._seq = itertools.count()
+        self._wakeup = None
+        # chat_id -> (checked_at, invite_link) for the join button on approval DMs
+        self._welcome_links = {}
+        self._welcome_locks = defaultdict(asyncio.Lock)
+        self.draining = False
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._heap)
+
+    def add(self, chat, user, delay: float):
+        """Approve `user` into `chat` once `delay` seconds have passed."""
+        due_at = time.perf_counter() + delay
+        is_next = not self._heap or due_at < self._heap[0][0]
+        item = {"chat_id": chat.id, "chat_title": chat.title, "user_id": user.id, "mention": user.mention()}
+        heapq.heappush(self._heap, (due_at, next(self._seq), item))
+        if is_next and self._wakeup:
+            self._wakeup.set()
+
+    def summary(self) -> str:
+        return (
+            f"Join requests queued: {self.queue_depth}, approved: {self.approved}, failed: {self.failed}, "
+            f"lag p50 {self.latency.percentile('lag', 0.5):.1f} s, p99 {self.latency.percentile('lag', 0.99):.1f} s"
+        )
+
+    async def run(self, client):
+        self._wakeup = asyncio.Event()
+        while True:
+            timeout = None
+            if self._heap:
+                timeout = max(self._heap[0][0] - time.perf_counter(), 0)
+            if timeout != 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+
+            now = time.perf_counter()
+            by_chat = defaultdict(list)
+            while self._heap and self._heap[0][0] <= now:
+                due_at, _, item = heapq.heappop(self._heap)
+                by_chat[item["chat_id"]].append((due_at, item))
+            if by_chat:
+                await asyncio.gather(*(self._drain_chat(client, chat_id, items) for chat_id, items in by_chat.items()))
+
+    async def _drain_chat(self, client, chat_id: int, items: list):
+        # Always per user: approve_all_chat_join_requests would also approve requests
+        # this queue never accepted, or that haven't waited out their delay yet
+        for start in range(0, len(items), APPROVAL_BATCH_SIZE):
+            batch = items[start:start + APPROVAL_BATCH_SIZE]
+            results = await asyncio.gather(*(self._approve_one(client, due_at, item) for due_at, item in batch))
+            await self._welcome_all(client, chat_id, [item for (_, item), ok in zip(batch, results) if ok])
+
+    async def _approve_one(self, client, due_at: float, item: dict) -> bool:
+        for _ in range(MAX_APPROVE_ATTEMPTS):
+            await self.bucket.acquire()
+            try:
+                await client.approve_chat_join_request(chat_id=item["chat_id"], user_id=item["user_id"])
+                self._record(due_at)
+                return True
+            except FloodWait as e:
+                self.bucket.pause(e.value)
+            except Exception as e:
+                # Includes users who joined some other way or withdrew the request
+                self.failed += 1
+                print(f"Error approving join request of {item['user_id']} for {item['chat_id']}: {e}")
+                return False
+        self.failed += 1
+        print(f"Gave up approving {item['user_id']} for {item['chat_id']} after {MAX_APPROVE_ATTEMPTS} FloodWaits")
+        return False
+
+    def _record(self, due_at: float):
+        self.approved += 1
+        self.latency.record("lag", due_at)
+        incr_stat("join_requests_approved", daily=True)
+
+    async def _welcome_all(self, client, chat_id: int, items: list):
+        if APPROVED != "on" or not items:
+            return
+        if not await self.welcome_link(client, chat_id):
+            return
+        await asyncio.gather(*(self._welcome(client, item) for item in items))
+
+    async def welcome_link(self, client, chat_id: int) -> Optional[str]:
+        """The chat's join link for approval DMs.
+
+        One additional link is created per chat with create_chat_invite_link and
+        stored, so approvals neither call Telegram for it nor replace the chat's
+        primary link the way export_chat_invite_link does. Every
+        WELCOME_LINK_REFRESH seconds the link is looked up again and replaced if
+        it has been revoked.
+        """
+        async with self._welcome_locks[chat_id]:
+            entry = self._welcome_links.get(chat_id)
+            if entry is None:
+                doc = await get_welcome_link(chat_id)
+                if doc:
+                    # A link stored without checked_at is treated as stale and checked now
+                    entry = self._welcome_links[chat_id] = (doc.get("checked_at") or datetime.min, doc["invite_link"])
+            if entry and datetime.utcnow() - entry[0] < timedelta(seconds=WELCOME_LINK_REFRESH):
+                return entry[1]
+
+            if entry:
+                await self.bucket.acquire()
+                try:
+                    current = await client.get_chat_invite_link(chat_id, entry[1])
+                    if not current.is_revoked:
+                        return await self._store_welcome_link(chat_id, entry[1])
+                except Exception as e:
+                    print(f"Error checking welcome link for {chat_id}, replacing it: {e}")
+
+            await self.bucket.acquire()
+            try:
+                link = await client.create_chat_invite_link(chat_id, name="Approval welcome")
+            except Exception as e:
+                print(f"Error creating welcome link for {chat_id}: {e}")
+                return None
+            return await self._store_welcome_link(chat_id, link.invite_link)
+
+    async def _store_welcome_link(self, chat_id: int, invite_link: str) -> str:
+        checked_at = datetime.utcnow()
+        self._welcome_links[chat_id] = (checked_at, invite_link)
+        await save_welcome_link(chat_id, invite_link, checked_at)
+        return invite_link
+
+    async def forget_welcome_link(self, chat_id: int):
+        """Drop a chat's welcome link, e.g. when the channel is removed or the bot loses admin."""
+        self._welcome_links.pop(chat_id, None)
+        await delete_welcome_link(chat_id)
+
+    async def _welcome(self, client, item: dict):
+        invite_link = await self.welcome_link(client, item["chat_id"])
+        if not invite_link:
+            return
+        markup = self._welcome_markup(item, invite_link)
+        caption = f"<b>ʜᴇʏ {item['mention']},\n\n<blockquote> ʏᴏᴜʀ ʀᴇǫᴜᴇsᴛ ᴛᴏ ᴊᴏɪɴ _{item['chat_title']} ʜᴀs ʙᴇᴇɴ ᴀᴘᴘʀᴏᴠᴇᴅ.</blockquote> </b>"
+
+        for _ in range(MAX_APPROVE_ATTEMPTS):
+            await self.bucket.acquire()
+            try:
+                await client.send_photo(chat_id=item["user_id"], photo=START_PIC, caption=caption, reply_markup=markup)
+                return
+            except FloodWait as e:
+                self.bucket.pause(e.value)
+            except Exception as e:
+                print(f"Error sending approval photo: {e}")
+                break
+        else:
+            return
+        try:
+            await client.send_message(chat_id=item["user_id"], text=caption, reply_markup=markup)
+        except Exception as e:
+            print(f"Error sending approval message to {item['user_id']}: {e}")
+
+    async def drain_pending(self, client) -> Optional[dict]:
+        """Approve join requests already pending in every managed chat.
+
+        Covers requests that arrived while the bot was down or were still
+        queued when it restarted. Bots can't list join requests, so the
+        USER_SESSION account lists them and the bot approves them. Returns
+        throughput figures, or None if a drain is already running.
+        """
+        if self.draining:
+            return None
+        report = {"chats": 0, "approved": 0, "failed": 0, "skipped": [], "no_session": not USER_SESSION,
+                  "session_error": None, "seconds": 0.0, "rate": 0.0}
+        if not USER_SESSION:
+            return report
+        self.draining = True
+        started = time.perf_counter()
+        user = Client(
+            name="JoinRequestDrain",
+            api_id=APP_ID,
+            api_hash=API_HASH,
+            session_string=USER_SESSION,
+            in_memory=True,
+            no_updates=True,
+        )
+        try:
+            try:
+                await user.start()
+            except Exception as e:
+                report["session_error"] = str(e)
+                return report
+            # An in-memory session starts with no peers; without their access hashes
+            # every -100 chat id fails to resolve, so load them from the dialog list
+            try:
+                async for _ in user.get_dialogs():
+                    pass
+            except FloodWait as e:
+                report["session_error"] = f"FloodWait of {e.value}s while loading dialogs"
+                return report
+            if CHAT_ID:
+                chat_ids = [chat_id for chat_id in CHAT_ID if isinstance(chat_id, int)]
+            else:
+                chat_ids = [doc["channel_id"] async for doc in iter_channels()
+                            if doc.get("status") == "active" and doc["channel_id"] < 0]
+            for chat_id in chat_ids:
+                if await is_approval_off(chat_id):
+                    continue
+                report["chats"] += 1
+                await self._drain_chat_backlog(client, user, chat_id, report)
+        finally:
+            self.draining = False
+            if user.is_connected:
+                await user.stop()
+        report["seconds"] = time.perf_counter() - started
+        report["rate"] = report["approved"] / report["seconds"] if report["seconds"] else 0.0
+        return report
+
+    async def _drain_chat_backlog(self, client, user, chat_id: int, report: dict):
+        title = (await get_chat_infos([chat_id])).get(chat_id, {}).get("title")
+        batch = []
+
+        async def flush():
+            results = await asyncio.gather(*(self._approve_one(client, due_at, item) for due_at, item in batch))
+            approved = [item for (_, item), ok in zip(batch, results) if ok]
+            report["approved"] += len(approved)
+            report["failed"] += len(batch) - len(approved)
+            await self._welcome_all(client, chat_id, approved)
+            batch.clear()
+
+        try:
+            async for joiner in user.get_chat_join_requests(chat_id):
+                item = {"chat_id": chat_id, "chat_title": title or str(chat_id),
+                        "user_id": joiner.user.id, "mention": joiner.user.mention()}
+                batch.append((time.perf_counter(), item))
+                if len(batch) >= APPROVAL_BATCH_SIZE:
+                    await flush()
+            if batch:
+                await flush()
+        except FloodWait as e:
+            self.bucket.pause(e.value)
+            print(f"FloodWait while listing join requests for {chat_id}; the rest will be picked up by the next drain")
+        except (BotMethodInvalid, ChatAdminRequired) as e:
+            print(f"Skipping join requests for {chat_id}: the USER_SESSION account can't list them ({e})")
+            report["skipped"].append(chat_id)
+        except RPCError as e:
+            print(f"Error listing join requests for {chat_id}: {e}")
+            report["skipped"].append(chat_id)
+
+    @staticmethod
+    def _welcome_markup(item: dict, invite_link: str) -> InlineKeyboardMarkup:
+        return InlineKeyboardMarkup([
+            [InlineKeyboardButton('🔥 ᴊᴏɪɴ ᴍʏ ᴜᴘᴅᴀᴛᴇs ᴄʜᴀɴɴᴇʟ', url='https://t.me/PR_ALL_BOT')],
+            [InlineKeyboardButton(f'• ᴊᴏɪɴ {item["chat_title"]} •', url=invite_link)]
+        ])
+
+
+def drain_report_text(report: dict) -> str:
+    if report["no_session"]:
+        return "USER_SESSION is not set: bots can't list pending join requests, so nothing was drained."
+    if report["session_error"]:
+        return f"Could not start the USER_SESSION account ({report['session_error']}), so nothing was drained."
+    text = (
+        f"Drained join requests in {report['chats']} chats: {report['approved']} approved, "
+        f"{report['failed']} failed in {report['seconds']:.1f} s ({report['rate']:.1f}/s)"
+    )
+    if report["skipped"]:
+        text += f"\nSkipped (user account not admin or not allowed): {', '.join(str(chat_id) for chat_id in report['skipped'])}"
+    return text
+
+
+approval_queue = ApprovalQueue()
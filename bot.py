@@ -3,8 +3,9 @@ import asyncio
 import sys
 from datetime import datetime
 from pyrogram import Client
+from pyrogram.errors import FloodWait
 from pyrogram.enums import ParseMode
-from config import API_HASH, APP_ID, LOGGER, TG_BOT_TOKEN, TG_BOT_WORKERS, PORT, OWNER_ID
+from config import API_HASH, APP_ID, LOGGER, TG_BOT_TOKEN, TG_BOT_WORKERS, PORT, OWNER_ID, LINK_CACHE_TTL, ADMIN_CACHE_TTL, CHAT_INFO_TTL
 from plugins import web_server
 import pyrogram.utils
 from aiohttp import web
@@ -47,6 +48,42 @@ class Bot(Client):
         self.LOGGER(__name__).info(f"{name}")
         self.username = usr_bot_me.username
 
+        from database.database import ensure_indexes, load_revoked_channels, run_user_registrar, init_stats, run_stats_flusher, load_admins
+        from database.database import backfill_encoded_links, load_settings, poll_settings
+        await ensure_indexes()
+        await load_revoked_channels()
+        await load_admins()
+        await load_settings()
+        await init_stats()
+        # One-off: channels added before tokens were stored at /addch get them now,
+        # so the listing commands never have to write
+        backfilled = await backfill_encoded_links()
+        if backfilled:
+            self.LOGGER(__name__).info(f"Stored link tokens for {backfilled} channel(s)")
+        asyncio.create_task(self.refresh_revoked_channels())
+        asyncio.create_task(self.refresh_admins())
+        asyncio.create_task(self.refresh_chat_info())
+        asyncio.create_task(run_user_registrar())
+        asyncio.create_task(run_stats_flusher())
+        asyncio.create_task(poll_settings())
+
+        # Delayed revocations/deletions from before a restart fire as soon as they are due
+        from scheduler import scheduler
+        reloaded = await scheduler.load()
+        asyncio.create_task(scheduler.run(self))
+        self.LOGGER(__name__).info(f"Scheduler started with {reloaded} pending actions")
+
+        # Join requests are approved from one queue instead of a sleeping handler each
+        from approvals import approval_queue
+        asyncio.create_task(approval_queue.run(self))
+        asyncio.create_task(self.drain_join_requests())
+
+        # Broadcasts interrupted by the restart continue from their last checkpoint
+        from broadcast import resume_broadcasts
+        resumed = await resume_broadcasts(self)
+        if resumed:
+            self.LOGGER(__name__).info(f"Resumed {resumed} broadcast(s)")
+
         # Web-response
         try:
             app = web.AppRunner(await web_server())
@@ -57,13 +94,48 @@ class Bot(Client):
         except Exception as e:
             self.LOGGER(__name__).error(f"Failed to start web server: {e}")
 
+    async def refresh_revoked_channels(self):
+        from database.database import load_revoked_channels
+        while True:
+            await asyncio.sleep(LINK_CACHE_TTL)
+            await load_revoked_channels()
+
+    async def refresh_admins(self):
+        from database.database import load_admins
+        while True:
+            await asyncio.sleep(ADMIN_CACHE_TTL)
+            await load_admins()
+
+    async def refresh_chat_info(self):
+        from database.database import get_stale_chat_info_channels, save_chat_info
+        while True:
+            for channel_id in await get_stale_chat_info_channels(CHAT_INFO_TTL):
+                try:
+                    chat = await self.get_chat(channel_id)
+                    await save_chat_info(channel_id, chat.title, chat.username)
+                except FloodWait as e:
+                    await asyncio.sleep(e.value)
+                except Exception as e:
+                    self.LOGGER(__name__).warning(f"Failed to refresh chat info for {channel_id}: {e}")
+                await asyncio.sleep(1)
+            await asyncio.sleep(CHAT_INFO_TTL / 4)
+
+    async def drain_join_requests(self):
+        # Requests that arrived while the bot was down, or were queued when it stopped
+        from approvals import approval_queue, drain_report_text
+        from database.database import get_setting
+        if not get_setting("auto_approve_enabled"):
+            return
+        report = await approval_queue.drain_pending(self)
+        if report and (report["no_session"] or report["session_error"] or report["approved"] or report["failed"] or report["skipped"]):
+            self.LOGGER(__name__).info(drain_report_text(report))
+
     async def stop(self, *args):
+        from database.database import flush_users, flush_stats
+        await flush_users()
+        await flush_stats()
         await super().stop()
         self.LOGGER(__name__).info("Bot stopped.")
 
-# Global cancel flag for broadcast
-is_canceled = False
-cancel_lock = asyncio.Lock()
-
 if __name__ == "__main__":
     Bot().run()
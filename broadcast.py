@@ -0,0 +1,464 @@
+import asyncio
+import os
+import socket
+import time
+from collections import Counter, deque
+from datetime import datetime, timedelta
+from pyrogram.enums import ParseMode
+from pyrogram.errors import FloodWait, UserIsBlocked, InputUserDeactivated
+from config import BROADCAST_WORKERS, BROADCAST_RATE, BROADCAST_BATCH_SIZE, BROADCAST_ARCHIVE_DEAD, BROADCAST_PROGRESS_INTERVAL
+from config import BROADCAST_PARTITIONS, BROADCAST_LEASE_SECONDS
+from database.database import del_users, iter_user_ids, get_user_id_splits, get_stats
+from database.database import create_broadcast, update_broadcast, get_broadcast, get_broadcasts, set_broadcast_status
+from database.database import create_broadcast_partitions, claim_broadcast_partition, update_broadcast_partition
+from database.database import get_broadcast_partitions, count_open_partitions, incr_stat
+from helper_func import TokenBucket, get_readable_time
+
+MAX_SEND_ATTEMPTS = 3
+THROUGHPUT_WINDOW = 30  # seconds of progress used for the live rate
+BAR_LENGTH = 20
+
+COUNTERS = ("processed", "successful", "blocked", "deleted", "unsuccessful", "pruned")
+
+# Identifies this process when it leases partitions
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# job id -> BroadcastJob whose progress this process reports
+active_broadcasts = {}
+# job id -> PartitionSenders running in this process (so /cancel stops them at once)
+_local_senders = {}
+# One limiter per process: all partitions sent from here share it
+_bucket = None
+
+
+def _shared_bucket() -> TokenBucket:
+    global _bucket
+    if _bucket is None:
+        _bucket = TokenBucket(BROADCAST_RATE)
+    return _bucket
+
+
+class PartitionSender:
+    """Sends one leased _id range of a broadcast.
+
+    The lease is renewed by a heartbeat and checked on every checkpoint; once
+    it is lost (another worker took over an expired lease) no further sends are
+    started and the sender stops without checkpointing. Delivery is
+    at-least-once: the cursor only moves after a batch is done, so a crash or
+    a lost lease lets the next owner repeat whatever part of the current batch
+    was already sent, plus any sends that were in flight when the lease was lost.
+
+    Sends go through a pool of workers behind the process-wide token bucket.
+    Every recipient is a different chat, so Telegram's 1 msg/s per-chat limit is
+    never the bottleneck. BROADCAST_RATE is per process: with several worker
+    processes on one bot token, keep their sum within the bot's allowance.
+    """
+
+    def __init__(self, client, job: dict, partition: dict, workers: int = BROADCAST_WORKERS):
+        self.client = client
+        self.job_id = job["_id"]
+        self.from_chat_id = job["from_chat_id"]
+        self.message_id = job["message_id"]
+        self.silent = job.get("silent", False)
+        self.partition_id = partition["_id"]
+        self.cursor = partition.get("cursor")
+        self.before = partition.get("before")
+        for name in COUNTERS:
+            setattr(self, name, partition.get(name, 0))
+        self.floodwait_seconds = partition.get("floodwait_seconds", 0)
+        self.errors = Counter(partition.get("errors", {}))
+
+        self.workers = workers
+        self.bucket = _shared_bucket()
+        self.canceled = False
+        self.lease_lost = False
+        # blocked/deactivated users, removed in one delete_many per batch
+        self.dead_users = []
+
+    def cancel(self):
+        self.canceled = True
+
+    async def _peer_known(self, chat_id: int) -> bool:
+        try:
+            await self.client.storage.get_peer_by_id(chat_id)
+            return True
+        except KeyError:
+            return False
+
+    async def _send(self, chat_id: int):
+        # An unknown user is resolved with users.GetUsers before the copy, which counts against the rate too
+        if not await self._peer_known(chat_id):
+            await self.bucket.acquire()
+        for _ in range(MAX_SEND_ATTEMPTS):
+            await self.bucket.acquire()
+            try:
+                await self.client.copy_message(
+                    chat_id, self.from_chat_id, self.message_id, disable_notification=self.silent
+                )
+                self.successful += 1
+                return
+            except FloodWait as e:
+                self.bucket.pause(e.value)
+                self.floodwait_seconds += e.value
+                self.errors["FloodWait"] += 1
+            except UserIsBlocked:
+                self.dead_users.append(chat_id)
+                self.blocked += 1
+                return
+            except InputUserDeactivated:
+                self.dead_users.append(chat_id)
+                self.deleted += 1
+                return
+            except Exception as e:
+                self.errors[type(e).__name__] += 1
+                break
+        self.unsuccessful += 1
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            chat_id = await queue.get()
+            try:
+                if chat_id is None:
+                    return
+                # The heartbeat flags a lost lease; stop sending at once instead of at the batch boundary
+                if not self.canceled and not self.lease_lost:
+                    await self._send(chat_id)
+                    self.processed += 1
+            finally:
+                queue.task_done()
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(BROADCAST_LEASE_SECONDS / 3)
+            lease_until = datetime.utcnow() + timedelta(seconds=BROADCAST_LEASE_SECONDS)
+            if not await update_broadcast_partition(self.partition_id, WORKER_ID, {"lease_until": lease_until}):
+                self.lease_lost = True
+                return
+
+    async def prune_dead_users(self):
+        if not self.dead_users:
+            return
+        dead_users, self.dead_users = self.dead_users, []
+        self.pruned += await del_users(dead_users, archive=BROADCAST_ARCHIVE_DEAD)
+
+    async def checkpoint(self, status: str = "pending", release: bool = False) -> bool:
+        await self.prune_dead_users()
+        fields = {
+            "status": status,
+            "cursor": self.cursor,
+            "floodwait_seconds": self.floodwait_seconds,
+            "errors": dict(self.errors),
+        }
+        fields.update({name: getattr(self, name) for name in COUNTERS})
+        if release:
+            fields["lease_until"] = None
+        return await update_broadcast_partition(self.partition_id, WORKER_ID, fields)
+
+    async def run(self):
+        """Send from the partition's cursor until it is done, the job stops, or the lease is lost."""
+        queue = asyncio.Queue(maxsize=self.workers * 2)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.workers)]
+        heartbeat = asyncio.create_task(self._heartbeat())
+        batches = iter_user_ids(self.cursor, BROADCAST_BATCH_SIZE, before=self.before)
+        # Fetch the next batch while the current one is being sent
+        next_batch = asyncio.ensure_future(batches.__anext__())
+        status = "pending"
+        try:
+            while not self.canceled and not self.lease_lost:
+                try:
+                    batch = await next_batch
+                except StopAsyncIteration:
+                    status = "done"
+                    break
+                next_batch = asyncio.ensure_future(batches.__anext__())
+                for chat_id in batch:
+                    await queue.put(chat_id)
+                await queue.join()
+                if self.canceled or self.lease_lost:
+                    break
+                self.cursor = batch[-1]
+                if not await self.checkpoint():
+                    self.lease_lost = True
+                    break
+                # Pause/cancel may come from any process, so the job state is read from the database
+                job = await get_broadcast(self.job_id)
+                if not job or job.get("status") != "running":
+                    break
+        finally:
+            heartbeat.cancel()
+            if not next_batch.done():
+                next_batch.cancel()
+            await asyncio.gather(heartbeat, next_batch, return_exceptions=True)
+            await batches.aclose()
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers, return_exceptions=True)
+            if not self.lease_lost:
+                await self.checkpoint(status, release=True)
+
+
+async def work_on_broadcast(client, job_id):
+    """Claim and send partitions of a running job until none are left to claim."""
+    senders = _local_senders.setdefault(job_id, set())
+    try:
+        while True:
+            job = await get_broadcast(job_id)
+            if not job or job.get("status") != "running":
+                return
+            partition = await claim_broadcast_partition(job_id, WORKER_ID, BROADCAST_LEASE_SECONDS)
+            if not partition:
+                if await count_open_partitions(job_id) == 0:
+                    await set_broadcast_status(job_id, "done", ["running"])
+                    return
+                # Other workers hold the rest (or the count failed and is retried);
+                # take over any whose lease runs out
+                await asyncio.sleep(BROADCAST_LEASE_SECONDS / 4)
+                continue
+            sender = PartitionSender(client, job, partition)
+            senders.add(sender)
+            try:
+                await sender.run()
+            finally:
+                senders.discard(sender)
+    finally:
+        if not senders:
+            _local_senders.pop(job_id, None)
+
+
+async def work_on_broadcasts_forever(client, poll_interval: int = 10):
+    """Entry point for extra sender processes: help with every running job."""
+    while True:
+        for job in await get_broadcasts(["running"]):
+            try:
+                await work_on_broadcast(client, job["_id"])
+            except Exception as e:
+                print(f"Error working on broadcast {job['_id']}: {e}")
+        await asyncio.sleep(poll_interval)
+
+
+class BroadcastJob:
+    """Progress of a broadcast stored in the `broadcasts` collection, summed over its partitions."""
+
+    def __init__(self, client, doc: dict):
+        self.client = client
+        self.job_id = doc["_id"]
+        self.silent = doc.get("silent", False)
+        self.status_chat_id = doc.get("status_chat_id")
+        self.status_message_id = doc.get("status_message_id")
+        self.status = doc.get("status", "running")
+        self.total = doc.get("total", 0)
+        for name in COUNTERS:
+            setattr(self, name, doc.get(name, 0))
+        self.floodwait_seconds = doc.get("floodwait_seconds", 0)
+        self.errors = Counter(doc.get("errors", {}))
+        # (monotonic time, successful) samples for the live rate
+        self.samples = deque()
+
+    @classmethod
+    async def create(cls, client, broadcast_msg, status_msg, silent: bool = False):
+        doc = {
+            "from_chat_id": broadcast_msg.chat.id,
+            "message_id": broadcast_msg.id,
+            "silent": silent,
+            "status_chat_id": status_msg.chat.id,
+            "status_message_id": status_msg.id,
+            "status": "pending",
+            # The maintained counter, not a count over the whole users collection
+            "total": (await get_stats())["global"].get("total_users", 0),
+        }
+        doc.update({name: 0 for name in COUNTERS})
+        job_id = await create_broadcast(doc)
+        if job_id is None:
+            return None
+        doc["_id"] = job_id
+
+        # Partition i covers ids from splits[i] up to (not including) splits[i + 1]
+        splits = await get_user_id_splits(BROADCAST_PARTITIONS) or [None]
+        partitions = []
+        for index, low in enumerate(splits):
+            high = splits[index + 1] if index + 1 < len(splits) else None
+            partition = {
+                "job_id": job_id,
+                "index": index,
+                "cursor": low - 1 if index > 0 else None,
+                "before": high,
+                "status": "pending",
+                "lease_owner": None,
+                "lease_until": None,
+            }
+            partition.update({name: 0 for name in COUNTERS})
+            partitions.append(partition)
+        if not await create_broadcast_partitions(partitions):
+            await set_broadcast_status(job_id, "canceled", ["pending"])
+            return None
+        await set_broadcast_status(job_id, "running", ["pending"])
+        doc["status"] = "running"
+        return cls(client, doc)
+
+    async def refresh(self):
+        doc = await get_broadcast(self.job_id)
+        if doc:
+            self.status = doc.get("status", self.status)
+        partitions = await get_broadcast_partitions(self.job_id)
+        if not partitions:
+            return
+        for name in COUNTERS:
+            setattr(self, name, sum(partition.get(name, 0) for partition in partitions))
+        self.floodwait_seconds = sum(partition.get("floodwait_seconds", 0) for partition in partitions)
+        self.errors = Counter()
+        for partition in partitions:
+            self.errors.update(partition.get("errors", {}))
+
+        now = time.monotonic()
+        self.samples.append((now, self.successful))
+        while len(self.samples) > 2 and now - self.samples[0][0] > THROUGHPUT_WINDOW:
+            self.samples.popleft()
+
+    @property
+    def throughput(self) -> float:
+        """Successful sends per second across all workers, over the last THROUGHPUT_WINDOW seconds."""
+        if len(self.samples) < 2:
+            return 0.0
+        (start, sent_before), (end, sent_now) = self.samples[0], self.samples[-1]
+        return (sent_now - sent_before) / (end - start) if end > start else 0.0
+
+    @property
+    def eta(self) -> float:
+        rate = self.throughput
+        remaining = max(self.total - self.processed, 0)
+        return remaining / rate if rate else 0.0
+
+    def telemetry(self) -> dict:
+        return {
+            "job_id": str(self.job_id),
+            "status": self.status,
+            "total": self.total,
+            **{name: getattr(self, name) for name in COUNTERS},
+            "sends_per_second": round(self.throughput, 2),
+            "floodwait_seconds": self.floodwait_seconds,
+            "eta_seconds": round(self.eta),
+            "errors": dict(self.errors),
+        }
+
+
+def broadcast_status_text(job: BroadcastJob) -> str:
+    mode = "Silent " if job.silent else ""
+    percent_complete = min(job.processed / job.total, 1) if job.total else 1
+    num_blocks = int(percent_complete * BAR_LENGTH)
+    progress_bar = "●" * num_blocks + "○" * (BAR_LENGTH - num_blocks)
+
+    if job.status == "done":
+        header = f"🤖 {mode}Broadcast Completed ✅"
+    elif job.status == "canceled":
+        header = f"🤖 {mode}Broadcast Canceled ❌"
+    elif job.status == "paused":
+        header = f"🤖 {mode}Broadcast Paused ⏸"
+    else:
+        header = f"🤖 {mode}Broadcast in Progress..."
+
+    text = f"""<b>{header}
+
+Progress: [{progress_bar}] {percent_complete:.0%}
+
+Total Users: {job.total}
+Successful: {job.successful}
+Blocked Users: {job.blocked}
+Deleted Accounts: {job.deleted}
+Removed From Database: {job.pruned}
+Unsuccessful: {job.unsuccessful}</b>"""
+
+    if job.status == "running":
+        text += (
+            f"\n\n<b>Speed: {job.throughput:.1f} msg/s\n"
+            f"ETA: {get_readable_time(int(job.eta))}\n"
+            f"FloodWait: {job.floodwait_seconds}s</b>"
+        )
+    if job.errors:
+        text += "\n\n<b>Errors:</b>\n" + "\n".join(
+            f"<code>{name}</code>: {count}" for name, count in job.errors.most_common(5)
+        )
+
+    if job.status == "running":
+        text += "\n\n<i>To stop the broadcast, use: /cancel\nTo pause it, use: /pausebroadcast</i>"
+    elif job.status == "paused":
+        text += f"\n\n<i>To continue, use: /resumebroadcast {job.job_id}</i>"
+    return text
+
+
+async def _edit_status(job: BroadcastJob):
+    if not job.status_chat_id:
+        return
+    try:
+        await job.client.edit_message_text(
+            job.status_chat_id, job.status_message_id, broadcast_status_text(job), parse_mode=ParseMode.HTML
+        )
+    except Exception as e:
+        print(f"Error updating broadcast progress: {e}")
+
+
+async def run_broadcast(job: BroadcastJob):
+    """Send with this process's workers and keep the job's status message up to date."""
+    active_broadcasts[str(job.job_id)] = job
+    worker = asyncio.create_task(work_on_broadcast(job.client, job.job_id))
+    try:
+        while True:
+            if not worker.done():
+                await asyncio.wait([worker], timeout=BROADCAST_PROGRESS_INTERVAL)
+            await job.refresh()
+            if job.status != "running":
+                break
+            await _edit_status(job)
+            # Other processes may still be sending after our worker runs out of partitions
+            if worker.done():
+                await asyncio.sleep(BROADCAST_PROGRESS_INTERVAL)
+        await worker
+    except Exception as e:
+        print(f"Broadcast {job.job_id} stopped with an error: {e}")
+    finally:
+        active_broadcasts.pop(str(job.job_id), None)
+
+    fields = {name: getattr(job, name) for name in COUNTERS}
+    fields.update({"floodwait_seconds": job.floodwait_seconds, "errors": dict(job.errors)})
+    await update_broadcast(job.job_id, fields)
+    if job.status == "done":
+        incr_stat("broadcasts_sent")
+        incr_stat("broadcast_messages", job.successful)
+    await _edit_status(job)
+
+
+async def cancel_broadcasts() -> int:
+    """Cancel running and paused broadcasts. Returns how many were canceled."""
+    canceled = 0
+    for doc in await get_broadcasts(["running", "paused"]):
+        if await set_broadcast_status(doc["_id"], "canceled", ["running", "paused"]):
+            canceled += 1
+        for sender in _local_senders.get(doc["_id"], ()):
+            sender.cancel()
+    return canceled
+
+
+async def pause_broadcasts() -> int:
+    """Pause running broadcasts; every worker stops after its current batch."""
+    paused = 0
+    for doc in await get_broadcasts(["running"]):
+        if await set_broadcast_status(doc["_id"], "paused", ["running"]):
+            paused += 1
+    return paused
+
+
+async def resume_broadcasts(client, job_id: str = None, statuses=("running",)) -> int:
+    """Restart stored jobs from their checkpoints (all running ones at boot, or paused ones on command)."""
+    resumed = 0
+    for doc in await get_broadcasts(list(statuses)):
+        if str(doc["_id"]) in active_broadcasts:
+            continue
+        if job_id and str(doc["_id"]) != job_id:
+            continue
+        if doc["status"] != "running" and not await set_broadcast_status(doc["_id"], "running", [doc["status"]]):
+            continue
+        doc["status"] = "running"
+        asyncio.create_task(run_broadcast(BroadcastJob(client, doc)))
+        resumed += 1
+        if job_id:
+            break
+    return resumed
@@ -3,6 +3,7 @@ import os
 from os import environ
 import logging
 import re
+import hashlib
 from logging.handlers import RotatingFileHandler
 
 # Recommended
@@ -13,6 +14,8 @@ API_HASH = os.environ.get("API_HASH", "")
 # Main
 OWNER_ID = int(os.environ.get("OWNER_ID", "7753899951"))
 PORT = int(os.environ.get("PORT", "5000"))
+# Token required by the JSON status routes on the web server; they are disabled while it is empty
+WEB_STATUS_TOKEN = os.environ.get("WEB_STATUS_TOKEN", "")
 
 # Database
 DB_URI = os.environ.get("DB_URI", "mongodb://localhost:27017")
@@ -28,6 +31,62 @@ APPROVED = environ.get("APPROVED_WELCOME", "on").lower()
 
 # Default
 TG_BOT_WORKERS = int(os.environ.get("TG_BOT_WORKERS", "40"))
+
+# Priority lanes: /start deep links keep pyrogram's TG_BOT_WORKERS to themselves,
+# everything slower runs in its own lane with this many workers
+LANE_CALLBACK_WORKERS = int(os.environ.get("LANE_CALLBACK_WORKERS", "8"))
+LANE_JOIN_REQUEST_WORKERS = int(os.environ.get("LANE_JOIN_REQUEST_WORKERS", "4"))
+LANE_ADMIN_WORKERS = int(os.environ.get("LANE_ADMIN_WORKERS", "4"))
+LANE_BULK_WORKERS = int(os.environ.get("LANE_BULK_WORKERS", "2"))  # broadcasts, bulk links, exports, drains
+
+# Invite link pool - one live link per channel is shared by every user
+INVITE_LINK_LIFETIME = int(os.environ.get("INVITE_LINK_LIFETIME", "600"))  # seconds a minted link stays valid
+INVITE_LINK_MIN_VALIDITY = int(os.environ.get("INVITE_LINK_MIN_VALIDITY", "300"))  # every user gets at least this much time
+INVITE_LINK_ROTATE_AHEAD = int(os.environ.get("INVITE_LINK_ROTATE_AHEAD", "60"))  # start rotating this long before the link is too old
+if INVITE_LINK_LIFETIME <= INVITE_LINK_MIN_VALIDITY + INVITE_LINK_ROTATE_AHEAD:
+    # Otherwise every freshly minted link is already due for rotation and each request mints a new one
+    raise Exception("INVITE_LINK_LIFETIME must be greater than INVITE_LINK_MIN_VALIDITY + INVITE_LINK_ROTATE_AHEAD.")
+
+# Deep-link token cache
+LINK_CACHE_SIZE = int(os.environ.get("LINK_CACHE_SIZE", "5000"))
+LINK_CACHE_TTL = int(os.environ.get("LINK_CACHE_TTL", "600"))  # seconds
+
+# Admin ids are kept in memory and reloaded from the database this often
+ADMIN_CACHE_TTL = int(os.environ.get("ADMIN_CACHE_TTL", "300"))  # seconds
+
+# Channel titles shown on the listing pages are cached and refreshed in the background
+CHAT_INFO_TTL = int(os.environ.get("CHAT_INFO_TTL", "3600"))  # seconds
+CHAT_INFO_FAILURE_TTL = int(os.environ.get("CHAT_INFO_FAILURE_TTL", "600"))  # seconds before a chat that failed get_chat is looked up again
+
+# Write-behind user registration
+USER_FLUSH_INTERVAL = float(os.environ.get("USER_FLUSH_INTERVAL", "2"))  # seconds between flushes
+USER_FLUSH_BATCH = int(os.environ.get("USER_FLUSH_BATCH", "500"))  # flush early once this many users are waiting
+KNOWN_USERS_CACHE_SIZE = int(os.environ.get("KNOWN_USERS_CACHE_SIZE", "1000000"))
+
+# Broadcast - Telegram allows roughly 30 messages/second overall and 1/second per chat
+BROADCAST_WORKERS = int(os.environ.get("BROADCAST_WORKERS", "20"))
+# Requests per second, including the users.GetUsers lookup Telegram needs before the first
+# message to a user this process's session has never seen (one extra request per new recipient)
+BROADCAST_RATE = float(os.environ.get("BROADCAST_RATE", "25"))
+BROADCAST_WORKER_NAME = os.environ.get("BROADCAST_WORKER_NAME", "")  # session name of this worker.py; unique per process on a host
+BROADCAST_BATCH_SIZE = int(os.environ.get("BROADCAST_BATCH_SIZE", "500"))  # users per checkpoint
+BROADCAST_PARTITIONS = int(os.environ.get("BROADCAST_PARTITIONS", "8"))  # _id ranges workers can claim
+BROADCAST_LEASE_SECONDS = int(os.environ.get("BROADCAST_LEASE_SECONDS", "120"))
+BROADCAST_PROGRESS_INTERVAL = int(os.environ.get("BROADCAST_PROGRESS_INTERVAL", "10"))  # seconds between progress edits
+BROADCAST_ARCHIVE_DEAD = os.environ.get("BROADCAST_ARCHIVE_DEAD", "off").lower() == "on"  # keep blocked/deleted users in dead_users
+
+# Join-request approvals are queued and drained per chat under a rate limit
+APPROVAL_RATE = float(os.environ.get("APPROVAL_RATE", "20"))  # approvals per second
+APPROVAL_BATCH_SIZE = int(os.environ.get("APPROVAL_BATCH_SIZE", "100"))  # requests approved concurrently per chat
+SETTINGS_POLL_INTERVAL = float(os.environ.get("SETTINGS_POLL_INTERVAL", "5"))  # seconds between checks for settings changed by other instances
+# Session string of a user account that is admin in the managed chats. Bots can't list
+# pending join requests, so the startup / /drainrequests backlog drain needs it.
+USER_SESSION = os.environ.get("USER_SESSION", "")
+WELCOME_LINK_REFRESH = int(os.environ.get("WELCOME_LINK_REFRESH", "3600"))  # seconds between checks that the approval DM's join link isn't revoked
+
+# Key used to sign deep-link tokens. Defaults to one derived from the bot token;
+# set it explicitly if you ever rotate the token and want old links to keep working.
+LINK_SECRET = os.environ.get("LINK_SECRET", "") or hashlib.sha256(f"link-secret:{TG_BOT_TOKEN}".encode()).hexdigest()
 #--- ---- ---- --- --- --- - -- -  - - - - - - - - - - - --  - -
 
 # Start pic
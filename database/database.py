@@ -1,9 +1,15 @@
 
 import motor.motor_asyncio
+import asyncio
 import base64
-from config import DB_URI, DB_NAME
+import time
+from collections import OrderedDict, Counter
+from pymongo import UpdateOne, ReturnDocument
+from config import DB_URI, DB_NAME, LINK_CACHE_SIZE, LINK_CACHE_TTL
+from config import USER_FLUSH_INTERVAL, USER_FLUSH_BATCH, KNOWN_USERS_CACHE_SIZE, ADMINS, CHAT_INFO_TTL
+from config import SETTINGS_POLL_INTERVAL
 from datetime import datetime, timedelta
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 dbclient = motor.motor_asyncio.AsyncIOMotorClient(DB_URI)
 database = dbclient[DB_NAME]
@@ -12,23 +18,108 @@ database = dbclient[DB_NAME]
 user_data = database['users']
 channels_collection = database['channels']
 fsub_channels_collection = database['fsub_channels']
+revoked_links_collection = database['revoked_links']
+pending_actions_collection = database['pending_actions']
+broadcasts_collection = database['broadcasts']
+dead_users_collection = database['dead_users']
+broadcast_partitions_collection = database['broadcast_partitions']
+stats_collection = database['stats']
+welcome_links_collection = database['welcome_links']
+settings_collection = database['settings']
 
-async def add_user(user_id: int) -> bool:
-    """Add a user to the database if they don't exist."""
+# token -> (cached_at, resolved channel info), oldest first
+_link_cache = OrderedDict()
+
+# channel_id -> (cached_at, {"title": ..., "username": ...}) for the listing pages
+_chat_info_cache = {}
+
+# (cached_at, count) of active channels, for "page X of Y" on the listings
+_channel_count = None
+CHANNEL_COUNT_TTL = 60
+
+# channels whose signed links must stop working (deleted or deactivated)
+_revoked_channels = set()
+
+# Admin ids from config plus the admins collection, so the admin filters never touch the database
+_admin_ids = set(ADMINS)
+
+# Snapshot of runtime settings. Every change bumps the version on the "global"
+# settings document, and each instance reloads when it sees a new version.
+DEFAULT_SETTINGS = {"approval_wait_time": 5, "auto_approve_enabled": True}
+_settings = dict(DEFAULT_SETTINGS)
+_approval_off_chats = set()
+_settings_version = None
+
+# Write-behind user registration: ids already in the database, and ids waiting to be flushed
+_known_users = set()
+_pending_users = {}
+_user_flush_wakeup = None
+
+# Counter increments waiting to be written: (document id, field) -> amount
+_pending_stats = Counter()
+STATS_FLUSH_INTERVAL = 5
+
+async def ensure_indexes():
+    """Create the indexes the hot lookups rely on."""
+    try:
+        await channels_collection.create_index("channel_id")
+        await channels_collection.create_index("encoded_link")
+        await channels_collection.create_index("req_encoded_link")
+        await channels_collection.create_index([("status", 1), ("_id", 1)])
+        await pending_actions_collection.create_index("due_at")
+        await broadcast_partitions_collection.create_index([("job_id", 1), ("status", 1)])
+    except Exception as e:
+        print(f"Error creating indexes: {e}")
+
+def queue_user(user_id: int) -> bool:
+    """Register a user without waiting on the database; flushed in batches by run_user_registrar()."""
     if not isinstance(user_id, int) or user_id <= 0:
-        print(f"Invalid user_id: {user_id}")
         return False
-    
+    if user_id in _known_users or user_id in _pending_users:
+        return False
+    _pending_users[user_id] = datetime.utcnow()
+    if len(_pending_users) >= USER_FLUSH_BATCH and _user_flush_wakeup:
+        _user_flush_wakeup.set()
+    return True
+
+async def flush_users() -> int:
+    """Upsert all queued users in one unordered bulk write. Returns how many were new."""
+    if not _pending_users:
+        return 0
+    batch = dict(_pending_users)
+    _pending_users.clear()
     try:
-        existing_user = await user_data.find_one({'_id': user_id})
-        if existing_user:
-            return False
-        
-        await user_data.insert_one({'_id': user_id, 'created_at': datetime.utcnow()})
-        return True
+        result = await user_data.bulk_write(
+            [UpdateOne({'_id': user_id}, {'$setOnInsert': {'created_at': seen_at}}, upsert=True)
+             for user_id, seen_at in batch.items()],
+            ordered=False
+        )
     except Exception as e:
-        print(f"Error adding user {user_id}: {e}")
-        return False
+        print(f"Error flushing {len(batch)} users: {e}")
+        # Upserts are idempotent, so just try the whole batch again next time
+        for user_id, seen_at in batch.items():
+            _pending_users.setdefault(user_id, seen_at)
+        return 0
+
+    if len(_known_users) + len(batch) > KNOWN_USERS_CACHE_SIZE:
+        _known_users.clear()
+    _known_users.update(batch)
+    if result.upserted_count:
+        incr_stat("total_users", result.upserted_count)
+        incr_stat("new_users", result.upserted_count, daily=True)
+    return result.upserted_count
+
+async def run_user_registrar():
+    """Flush queued users every USER_FLUSH_INTERVAL seconds or as soon as a batch fills up."""
+    global _user_flush_wakeup
+    _user_flush_wakeup = asyncio.Event()
+    while True:
+        try:
+            await asyncio.wait_for(_user_flush_wakeup.wait(), USER_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _user_flush_wakeup.clear()
+        await flush_users()
 
 async def present_user(user_id: int) -> bool:
     """Check if a user exists in the database."""
@@ -36,33 +127,100 @@ async def present_user(user_id: int) -> bool:
         return False
     return bool(await user_data.find_one({'_id': user_id}))
 
-async def full_userbase() -> List[int]:
-    """Get all user IDs from the database."""
+async def iter_user_ids(after: Optional[int] = None, batch_size: int = 1000, before: Optional[int] = None):
+    """Stream user IDs in (`after`, `before`) in _id order, `batch_size` at a time.
+
+    Memory stays constant in the size of the userbase and the first batch is
+    available as soon as the server returns it.
+    """
+    id_range = {}
+    if after is not None:
+        id_range['$gt'] = after
+    if before is not None:
+        id_range['$lt'] = before
+    query = {'_id': id_range} if id_range else {}
+    cursor = user_data.find(query, projection={'_id': 1}).sort('_id', 1).batch_size(batch_size)
+    batch = []
+    async for doc in cursor:
+        batch.append(doc['_id'])
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+async def get_user_id_splits(parts: int) -> List[int]:
+    """Lowest user ID of each of `parts` roughly equal _id ranges."""
     try:
-        user_docs = user_data.find()
-        return [doc['_id'] async for doc in user_docs]
+        buckets = user_data.aggregate(
+            [{'$bucketAuto': {'groupBy': '$_id', 'buckets': parts}}],
+            allowDiskUse=True
+        )
+        return sorted([bucket['_id']['min'] async for bucket in buckets])
     except Exception as e:
-        print(f"Error fetching userbase: {e}")
+        print(f"Error splitting userbase: {e}")
         return []
 
 async def del_user(user_id: int) -> bool:
     """Delete a user from the database."""
     try:
         result = await user_data.delete_one({'_id': user_id})
+        _known_users.discard(user_id)
+        if result.deleted_count:
+            incr_stat("total_users", -result.deleted_count)
         return result.deleted_count > 0
     except Exception as e:
         print(f"Error deleting user {user_id}: {e}")
         return False
 
+async def del_users(user_ids: List[int], archive: bool = False) -> int:
+    """Delete many users in one round-trip, optionally copying them to dead_users first."""
+    if not user_ids:
+        return 0
+    try:
+        if archive:
+            now = datetime.utcnow()
+            try:
+                await dead_users_collection.insert_many(
+                    [{'_id': user_id, 'removed_at': now} for user_id in user_ids],
+                    ordered=False
+                )
+            except Exception as e:
+                # Already-archived ids raise duplicate key errors; the rest are inserted
+                print(f"Archiving dead users: {e}")
+        result = await user_data.delete_many({'_id': {'$in': user_ids}})
+        _known_users.difference_update(user_ids)
+        if result.deleted_count:
+            incr_stat("total_users", -result.deleted_count)
+        return result.deleted_count
+    except Exception as e:
+        print(f"Error deleting {len(user_ids)} users: {e}")
+        return 0
+
+def is_cached_admin(user_id: int) -> bool:
+    """Check the in-memory admin set."""
+    return user_id in _admin_ids
+
+async def load_admins() -> int:
+    """Reload the in-memory admin set from config and the admins collection."""
+    admins_collection = database['admins']
+    try:
+        admins = {doc['_id'] async for doc in admins_collection.find({}, projection={'_id': 1})}
+        _admin_ids.clear()
+        _admin_ids.update(ADMINS)
+        _admin_ids.update(admins)
+        return len(_admin_ids)
+    except Exception as e:
+        print(f"Error loading admins: {e}")
+        return len(_admin_ids)
+
 async def is_admin(user_id: int) -> bool:
     """Check if a user is an admin."""
-    admins_collection = database['admins']
     try:
         user_id = int(user_id)  # Ensure always int
-        return bool(await admins_collection.find_one({'_id': user_id}))
-    except Exception as e:
-        print(f"Error checking admin status for {user_id}: {e}")
+    except (TypeError, ValueError):
         return False
+    return is_cached_admin(user_id)
 
 async def add_admin(user_id: int) -> bool:
     """Add a user as admin."""
@@ -70,6 +228,7 @@ async def add_admin(user_id: int) -> bool:
     try:
         user_id = int(user_id)  # Ensure always int
         await admins_collection.update_one({'_id': user_id}, {'$set': {'_id': user_id}}, upsert=True)
+        _admin_ids.add(user_id)
         return True
     except Exception as e:
         print(f"Error adding admin {user_id}: {e}")
@@ -79,7 +238,10 @@ async def remove_admin(user_id: int) -> bool:
     """Remove a user from admins."""
     admins_collection = database['admins']
     try:
+        user_id = int(user_id)  # Ensure always int
         result = await admins_collection.delete_one({'_id': user_id})
+        if user_id not in ADMINS:
+            _admin_ids.discard(user_id)
         return result.deleted_count > 0
     except Exception as e:
         print(f"Error removing admin {user_id}: {e}")
@@ -114,32 +276,142 @@ async def save_channel(channel_id: int) -> bool:
             },
             upsert=True
         )
+        await revoked_links_collection.delete_one({"_id": channel_id})
+        _revoked_channels.discard(channel_id)
+        invalidate_channel_count()
         return True
     except Exception as e:
         print(f"Error saving channel {channel_id}: {e}")
         return False
 
-async def get_channels() -> List[int]:
-    """Get all active channel IDs from the database."""
+async def save_chat_info(channel_id: int, title: str, username: Optional[str] = None) -> bool:
+    """Store a channel's display metadata so listings don't need get_chat."""
+    info = {"title": title, "username": username}
     try:
-        channels = await channels_collection.find({"status": "active"}).to_list(None)
-        valid_channels = []
-        for channel in channels:
-            if isinstance(channel, dict) and "channel_id" in channel:
-                valid_channels.append(channel["channel_id"])
-            else:
-                print(f"Invalid channel document: {channel}")
-        if not valid_channels:
-            print(f"No valid channels found in database. Total documents checked: {len(channels)}")
-        return valid_channels
+        await channels_collection.update_one(
+            {"channel_id": channel_id},
+            {"$set": {"chat_info": info, "chat_info_updated_at": datetime.utcnow()}}
+        )
+        _chat_info_cache[channel_id] = (time.monotonic(), info)
+        return True
+    except Exception as e:
+        print(f"Error saving chat info for channel {channel_id}: {e}")
+        return False
+
+async def get_chat_infos(channel_ids: List[int]) -> dict:
+    """Get cached display metadata for channels. Channels never looked up are left out."""
+    now = time.monotonic()
+    infos = {}
+    missing = []
+    for channel_id in channel_ids:
+        entry = _chat_info_cache.get(channel_id)
+        if entry and now - entry[0] < CHAT_INFO_TTL:
+            infos[channel_id] = entry[1]
+        else:
+            missing.append(channel_id)
+    if not missing:
+        return infos
+    try:
+        cursor = channels_collection.find(
+            {"channel_id": {"$in": missing}, "chat_info": {"$exists": True}},
+            projection={"channel_id": 1, "chat_info": 1}
+        )
+        async for doc in cursor:
+            infos[doc["channel_id"]] = doc["chat_info"]
+            _chat_info_cache[doc["channel_id"]] = (now, doc["chat_info"])
+    except Exception as e:
+        print(f"Error fetching chat info for {len(missing)} channels: {e}")
+    return infos
+
+async def get_stale_chat_info_channels(max_age: int) -> List[int]:
+    """Active channels whose display metadata is missing or older than max_age seconds.
+
+    /genlink entries are keyed by a positive message id, not a chat, so they are left out.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=max_age)
+    try:
+        cursor = channels_collection.find(
+            {"status": "active", "channel_id": {"$lt": 0}, "$or": [
+                {"chat_info_updated_at": {"$exists": False}},
+                {"chat_info_updated_at": {"$lt": cutoff}}
+            ]},
+            projection={"channel_id": 1}
+        )
+        return [doc["channel_id"] async for doc in cursor]
     except Exception as e:
-        print(f"Error fetching channels: {e}")
+        print(f"Error fetching stale chat info: {e}")
         return []
 
+async def get_channel_page(limit: int, after: Optional[int] = None, before: Optional[int] = None) -> Tuple[Optional[List[int]], bool]:
+    """Fetch up to `limit` active channel ids in the order they were added, starting after channel
+    `after` or ending just before channel `before`. Also returns whether more channels lie beyond
+    the page. The channel list is None if the boundary channel no longer exists."""
+    # /genlink entries are keyed by a positive message id and aren't chats, so they aren't listed
+    query = {"status": "active", "channel_id": {"$lt": 0}}
+    order = 1
+    try:
+        boundary = before if before is not None else after
+        if boundary is not None:
+            # Pages are keyed on _id, which keeps the insertion order listings always had
+            anchor = await channels_collection.find_one({"channel_id": boundary}, projection={"_id": 1})
+            if not anchor:
+                return None, False
+            if before is not None:
+                query["_id"] = {"$lt": anchor["_id"]}
+                order = -1
+            else:
+                query["_id"] = {"$gt": anchor["_id"]}
+        cursor = channels_collection.find(
+            query, projection={"_id": 0, "channel_id": 1}
+        ).sort("_id", order).limit(limit + 1)
+        channel_ids = [doc["channel_id"] async for doc in cursor]
+    except Exception as e:
+        print(f"Error fetching channel page: {e}")
+        return [], False
+    more = len(channel_ids) > limit
+    channel_ids = channel_ids[:limit]
+    if order == -1:
+        channel_ids.reverse()
+    return channel_ids, more
+
+async def iter_channels(batch_size: int = 500):
+    """Stream every channel document with the fields an export needs, in channel_id order."""
+    cursor = channels_collection.find(
+        {"channel_id": {"$exists": True}},
+        projection={"_id": 0, "channel_id": 1, "status": 1, "chat_info": 1, "original_link": 1}
+    ).sort("channel_id", 1).batch_size(batch_size)
+    async for doc in cursor:
+        yield doc
+
+async def count_channels() -> int:
+    """Count active channels (not /genlink entries), cached for CHANNEL_COUNT_TTL seconds."""
+    global _channel_count
+    if _channel_count and time.monotonic() - _channel_count[0] < CHANNEL_COUNT_TTL:
+        return _channel_count[1]
+    try:
+        count = await channels_collection.count_documents({"status": "active", "channel_id": {"$lt": 0}})
+    except Exception as e:
+        print(f"Error counting channels: {e}")
+        return _channel_count[1] if _channel_count else 0
+    _channel_count = (time.monotonic(), count)
+    return count
+
+def invalidate_channel_count():
+    global _channel_count
+    _channel_count = None
+
 async def delete_channel(channel_id: int) -> bool:
     """Delete a channel from the database."""
     try:
         result = await channels_collection.delete_one({"channel_id": channel_id})
+        await revoked_links_collection.update_one(
+            {"_id": channel_id},
+            {"$set": {"revoked_at": datetime.utcnow()}},
+            upsert=True
+        )
+        _revoked_channels.add(channel_id)
+        _chat_info_cache.pop(channel_id, None)
+        invalidate_channel_count()
         return result.deleted_count > 0
     except Exception as e:
         print(f"Error deleting channel {channel_id}: {e}")
@@ -169,17 +441,48 @@ async def save_encoded_link(channel_id: int) -> Optional[str]:
         print(f"Error saving encoded link for channel {channel_id}: {e}")
         return None
 
-async def get_channel_by_encoded_link(encoded_link: str) -> Optional[int]:
-    """Get a channel ID by its encoded link."""
-    if not isinstance(encoded_link, str):
-        return None
-    
+async def backfill_encoded_links(channel_ids: Optional[List[int]] = None) -> int:
+    """Store the legacy tokens for channels that don't have them yet, in one bulk write.
+
+    With no ids, every channel document missing a token is filled in. Given ids,
+    channels not in the database yet are added. Returns the number of channels written.
+    """
+    missing_token = {"$or": [{"encoded_link": {"$exists": False}}, {"req_encoded_link": {"$exists": False}}]}
     try:
-        channel = await channels_collection.find_one({"encoded_link": encoded_link, "status": "active"})
-        return channel["channel_id"] if channel and "channel_id" in channel else None
+        if channel_ids is None:
+            cursor = channels_collection.find(
+                dict(missing_token, channel_id={"$exists": True}), projection={"channel_id": 1}
+            )
+            pending = [doc["channel_id"] async for doc in cursor]
+        else:
+            channel_ids = list(dict.fromkeys(channel_ids))
+            cursor = channels_collection.find(
+                {"channel_id": {"$in": channel_ids}, "encoded_link": {"$exists": True}, "req_encoded_link": {"$exists": True}},
+                projection={"channel_id": 1}
+            )
+            complete = {doc["channel_id"] async for doc in cursor}
+            pending = [channel_id for channel_id in channel_ids if channel_id not in complete]
+        if not pending:
+            return 0
+
+        now = datetime.utcnow()
+        operations = []
+        for channel_id in pending:
+            encoded_link = base64.urlsafe_b64encode(str(channel_id).encode()).decode()
+            operations.append(UpdateOne(
+                {"channel_id": channel_id},
+                {
+                    "$set": {"encoded_link": encoded_link, "req_encoded_link": encoded_link.rstrip("="), "updated_at": now},
+                    "$setOnInsert": {"status": "active", "created_at": now}
+                },
+                upsert=True
+            ))
+        await channels_collection.bulk_write(operations, ordered=False)
+        invalidate_channel_count()
+        return len(operations)
     except Exception as e:
-        print(f"Error fetching channel by encoded link {encoded_link}: {e}")
-        return None
+        print(f"Error backfilling encoded links: {e}")
+        return 0
 
 async def save_encoded_link2(channel_id: int, encoded_link: str) -> Optional[str]:
     """Save a secondary encoded link for a channel."""
@@ -204,20 +507,8 @@ async def save_encoded_link2(channel_id: int, encoded_link: str) -> Optional[str
         print(f"Error saving secondary encoded link for channel {channel_id}: {e}")
         return None
 
-async def get_channel_by_encoded_link2(encoded_link: str) -> Optional[int]:
-    """Get a channel ID by its secondary encoded link."""
-    if not isinstance(encoded_link, str):
-        return None
-    
-    try:
-        channel = await channels_collection.find_one({"req_encoded_link": encoded_link, "status": "active"})
-        return channel["channel_id"] if channel and "channel_id" in channel else None
-    except Exception as e:
-        print(f"Error fetching channel by secondary encoded link {encoded_link}: {e}")
-        return None
-
-async def save_invite_link(channel_id: int, invite_link: str, is_request: bool) -> bool:
-    """Save the current invite link for a channel and its type."""
+async def save_invite_link(channel_id: int, invite_link: str, is_request: bool, expire_date: Optional[datetime] = None) -> bool:
+    """Save the current invite link for a channel, its type and when it expires."""
     if not isinstance(channel_id, int) or not isinstance(invite_link, str):
         print(f"Invalid input: channel_id={channel_id}, invite_link={invite_link}")
         return False
@@ -230,6 +521,7 @@ async def save_invite_link(channel_id: int, invite_link: str, is_request: bool)
                     "current_invite_link": invite_link,
                     "is_request_link": is_request,
                     "invite_link_created_at": datetime.utcnow(),
+                    "invite_link_expiry": expire_date,
                     "status": "active"
                 }
             },
@@ -240,23 +532,36 @@ async def save_invite_link(channel_id: int, invite_link: str, is_request: bool)
         print(f"Error saving invite link for channel {channel_id}: {e}")
         return False
 
-async def get_current_invite_link(channel_id: int) -> Optional[dict]:
-    """Get the current invite link and its type for a channel."""
-    if not isinstance(channel_id, int):
-        return None
-    
+async def get_welcome_link(chat_id: int) -> Optional[dict]:
+    """Get the invite link used on approval DMs for a chat, with when it was last checked."""
     try:
-        channel = await channels_collection.find_one({"channel_id": channel_id, "status": "active"})
-        if channel and "current_invite_link" in channel:
-            return {
-                "invite_link": channel["current_invite_link"],
-                "is_request": channel.get("is_request_link", False)
-            }
-        return None
+        return await welcome_links_collection.find_one({"_id": chat_id})
     except Exception as e:
-        print(f"Error fetching current invite link for channel {channel_id}: {e}")
+        print(f"Error fetching welcome link for {chat_id}: {e}")
         return None
 
+async def save_welcome_link(chat_id: int, invite_link: str, checked_at: datetime) -> bool:
+    """Store the invite link used on approval DMs for a chat, with when it was last known valid."""
+    try:
+        await welcome_links_collection.update_one(
+            {"_id": chat_id},
+            {"$set": {"invite_link": invite_link, "checked_at": checked_at}},
+            upsert=True
+        )
+        return True
+    except Exception as e:
+        print(f"Error saving welcome link for {chat_id}: {e}")
+        return False
+
+async def delete_welcome_link(chat_id: int) -> bool:
+    """Forget the approval DM link for a chat."""
+    try:
+        await welcome_links_collection.delete_one({"_id": chat_id})
+        return True
+    except Exception as e:
+        print(f"Error deleting welcome link for {chat_id}: {e}")
+        return False
+
 async def add_fsub_channel(channel_id: int) -> bool:
     """Add a channel to the FSub list."""
     if not isinstance(channel_id, int):
@@ -296,17 +601,6 @@ async def get_fsub_channels() -> List[int]:
         print(f"Error fetching FSub channels: {e}")
         return []
 
-async def get_original_link(channel_id: int) -> Optional[str]:
-    """Get the original link stored for a channel (used by /genlink)."""
-    if not isinstance(channel_id, int):
-        return None
-    try:
-        channel = await channels_collection.find_one({"channel_id": channel_id, "status": "active"})
-        return channel.get("original_link") if channel and "original_link" in channel else None
-    except Exception as e:
-        print(f"Error fetching original link for channel {channel_id}: {e}")
-        return None
-
 async def set_approval_off(channel_id: int, off: bool = True) -> bool:
     """Set approval_off flag for a channel."""
     if not isinstance(channel_id, int):
@@ -318,6 +612,11 @@ async def set_approval_off(channel_id: int, off: bool = True) -> bool:
             {"$set": {"approval_off": off}},
             upsert=True
         )
+        await _bump_settings_version()
+        if off:
+            _approval_off_chats.add(channel_id)
+        else:
+            _approval_off_chats.discard(channel_id)
         return True
     except Exception as e:
         print(f"Error setting approval_off for channel {channel_id}: {e}")
@@ -325,11 +624,336 @@ async def set_approval_off(channel_id: int, off: bool = True) -> bool:
 
 async def is_approval_off(channel_id: int) -> bool:
     """Check if approval_off flag is set for a channel."""
+    return channel_id in _approval_off_chats
+
+def get_setting(name: str):
+    """Read a runtime setting from the in-memory snapshot."""
+    return _settings.get(name, DEFAULT_SETTINGS.get(name))
+
+async def set_setting(name: str, value) -> bool:
+    """Persist a global runtime setting; other instances pick it up on their next poll."""
+    try:
+        await settings_collection.update_one(
+            {"_id": "global"},
+            {"$set": {name: value}, "$inc": {"version": 1}},
+            upsert=True
+        )
+        _settings[name] = value
+        return True
+    except Exception as e:
+        print(f"Error saving setting {name}: {e}")
+        return False
+
+async def _bump_settings_version():
+    await settings_collection.update_one({"_id": "global"}, {"$inc": {"version": 1}}, upsert=True)
+
+async def load_settings() -> bool:
+    """Reload global settings and per-chat approval flags into memory."""
+    global _settings_version
+    try:
+        doc = await settings_collection.find_one({"_id": "global"}) or {}
+        off_chats = {
+            channel["channel_id"]
+            async for channel in channels_collection.find({"approval_off": True}, projection={"channel_id": 1})
+        }
+    except Exception as e:
+        print(f"Error loading settings: {e}")
+        return False
+    _settings.clear()
+    _settings.update(DEFAULT_SETTINGS)
+    _settings.update({name: doc[name] for name in DEFAULT_SETTINGS if name in doc})
+    _approval_off_chats.clear()
+    _approval_off_chats.update(off_chats)
+    _settings_version = doc.get("version", 0)
+    return True
+
+async def poll_settings():
+    """Reload the snapshot whenever another instance changes a setting."""
+    while True:
+        await asyncio.sleep(SETTINGS_POLL_INTERVAL)
+        try:
+            doc = await settings_collection.find_one({"_id": "global"}, projection={"version": 1})
+        except Exception as e:
+            print(f"Error polling settings: {e}")
+            continue
+        if (doc or {}).get("version", 0) != _settings_version:
+            await load_settings()
+
+async def _resolve_link(cache_key: str, query: dict, is_request: bool) -> Optional[dict]:
+    cached = _link_cache.get(cache_key)
+    if cached and time.monotonic() - cached[0] < LINK_CACHE_TTL:
+        _link_cache.move_to_end(cache_key)
+        return cached[1]
+
+    try:
+        channel = await channels_collection.find_one(
+            dict(query, status="active"),
+            projection={
+                "_id": 0,
+                "channel_id": 1,
+                "original_link": 1,
+                "current_invite_link": 1,
+                "is_request_link": 1,
+                "invite_link_expiry": 1
+            }
+        )
+    except Exception as e:
+        print(f"Error resolving link {cache_key}: {e}")
+        return None
+
+    if not channel or "channel_id" not in channel:
+        return None
+
+    info = {
+        "channel_id": channel["channel_id"],
+        "is_request": is_request,
+        "original_link": channel.get("original_link"),
+        "invite_link": channel.get("current_invite_link"),
+        "invite_is_request": channel.get("is_request_link", False),
+        "invite_link_expiry": channel.get("invite_link_expiry")
+    }
+    _link_cache[cache_key] = (time.monotonic(), info)
+    _link_cache.move_to_end(cache_key)
+    while len(_link_cache) > LINK_CACHE_SIZE:
+        _link_cache.popitem(last=False)
+    return info
+
+async def resolve_encoded_link(encoded_link: str, is_request: bool = False) -> Optional[dict]:
+    """Resolve a legacy /start token to its channel, original link and invite state in one query.
+
+    Results are kept in a bounded LRU cache so hot tokens never touch the database.
+    """
+    if not isinstance(encoded_link, str):
+        return None
+    field = "req_encoded_link" if is_request else "encoded_link"
+    cache_key = f"req_{encoded_link}" if is_request else encoded_link
+    return await _resolve_link(cache_key, {field: encoded_link}, is_request)
+
+async def resolve_channel_link(channel_id: int, is_request: bool = False) -> Optional[dict]:
+    """Same as resolve_encoded_link, for a channel id taken from a signed token."""
     if not isinstance(channel_id, int):
+        return None
+    cache_key = f"id:{'req_' if is_request else ''}{channel_id}"
+    return await _resolve_link(cache_key, {"channel_id": channel_id}, is_request)
+
+def invalidate_link_cache(channel_id: Optional[int] = None):
+    """Drop cached token resolutions for a channel, or all of them."""
+    if channel_id is None:
+        _link_cache.clear()
+        return
+    for key in [k for k, (_, info) in _link_cache.items() if info["channel_id"] == channel_id]:
+        _link_cache.pop(key, None)
+
+def is_channel_revoked(channel_id: int) -> bool:
+    """Check the in-memory deny-list for signed links."""
+    return channel_id in _revoked_channels
+
+async def load_revoked_channels() -> int:
+    """Reload the deny-list from deleted and deactivated channels."""
+    try:
+        revoked = {doc["_id"] async for doc in revoked_links_collection.find({}, projection={"_id": 1})}
+        inactive = channels_collection.find({"status": {"$ne": "active"}}, projection={"_id": 0, "channel_id": 1})
+        revoked.update([doc["channel_id"] async for doc in inactive if "channel_id" in doc])
+        _revoked_channels.clear()
+        _revoked_channels.update(revoked)
+        return len(revoked)
+    except Exception as e:
+        print(f"Error loading revoked channels: {e}")
+        return len(_revoked_channels)
+
+async def save_pending_action(kind: str, due_at: datetime, payload: dict):
+    """Persist a delayed action so it survives restarts. Returns its id."""
+    try:
+        result = await pending_actions_collection.insert_one({
+            "kind": kind,
+            "due_at": due_at,
+            "payload": payload,
+            "created_at": datetime.utcnow()
+        })
+        return result.inserted_id
+    except Exception as e:
+        print(f"Error saving pending {kind} action: {e}")
+        return None
+
+async def get_pending_actions() -> list:
+    """Get every delayed action that has not fired yet, soonest first."""
+    try:
+        return await pending_actions_collection.find().sort("due_at", 1).to_list(None)
+    except Exception as e:
+        print(f"Error fetching pending actions: {e}")
+        return []
+
+async def delete_pending_actions(action_ids: list) -> int:
+    """Remove fired actions in one round-trip."""
+    if not action_ids:
+        return 0
+    try:
+        result = await pending_actions_collection.delete_many({"_id": {"$in": action_ids}})
+        return result.deleted_count
+    except Exception as e:
+        print(f"Error deleting pending actions: {e}")
+        return 0
+
+async def create_broadcast(job: dict):
+    """Store a new broadcast job and return its id."""
+    try:
+        job = dict(job, created_at=datetime.utcnow(), updated_at=datetime.utcnow())
+        result = await broadcasts_collection.insert_one(job)
+        return result.inserted_id
+    except Exception as e:
+        print(f"Error creating broadcast: {e}")
+        return None
+
+async def update_broadcast(job_id, fields: dict) -> bool:
+    """Checkpoint a broadcast job (cursor, counters, status)."""
+    try:
+        await broadcasts_collection.update_one(
+            {"_id": job_id},
+            {"$set": dict(fields, updated_at=datetime.utcnow())}
+        )
+        return True
+    except Exception as e:
+        print(f"Error updating broadcast {job_id}: {e}")
         return False
+
+async def get_broadcast(job_id) -> Optional[dict]:
+    """Get one broadcast job."""
     try:
-        channel = await channels_collection.find_one({"channel_id": channel_id})
-        return bool(channel and channel.get("approval_off", False))
+        return await broadcasts_collection.find_one({"_id": job_id})
     except Exception as e:
-        print(f"Error checking approval_off for channel {channel_id}: {e}")
+        print(f"Error fetching broadcast {job_id}: {e}")
+        return None
+
+async def set_broadcast_status(job_id, status: str, from_statuses: List[str]) -> bool:
+    """Move a job to `status` if it is currently in one of `from_statuses`."""
+    try:
+        result = await broadcasts_collection.update_one(
+            {"_id": job_id, "status": {"$in": from_statuses}},
+            {"$set": {"status": status, "updated_at": datetime.utcnow()}}
+        )
+        return result.modified_count > 0
+    except Exception as e:
+        print(f"Error setting broadcast {job_id} to {status}: {e}")
         return False
+
+async def create_broadcast_partitions(partitions: List[dict]) -> bool:
+    """Store the _id ranges a broadcast is split into."""
+    try:
+        await broadcast_partitions_collection.insert_many(partitions)
+        return True
+    except Exception as e:
+        print(f"Error creating broadcast partitions: {e}")
+        return False
+
+async def claim_broadcast_partition(job_id, owner: str, lease_seconds: int) -> Optional[dict]:
+    """Lease an unfinished partition that nobody holds (or whose lease expired)."""
+    now = datetime.utcnow()
+    try:
+        return await broadcast_partitions_collection.find_one_and_update(
+            {
+                "job_id": job_id,
+                "status": "pending",
+                "$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}]
+            },
+            {"$set": {"lease_owner": owner, "lease_until": now + timedelta(seconds=lease_seconds)}},
+            sort=[("index", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+    except Exception as e:
+        print(f"Error claiming partition of broadcast {job_id}: {e}")
+        return None
+
+async def update_broadcast_partition(partition_id, owner: str, fields: dict) -> bool:
+    """Checkpoint a partition. Returns False if `owner` no longer holds its lease."""
+    try:
+        result = await broadcast_partitions_collection.update_one(
+            {"_id": partition_id, "lease_owner": owner},
+            {"$set": fields}
+        )
+        return result.matched_count > 0
+    except Exception as e:
+        print(f"Error updating partition {partition_id}: {e}")
+        return False
+
+async def get_broadcast_partitions(job_id) -> list:
+    """Get every partition of a job (used to sum up its progress)."""
+    try:
+        return await broadcast_partitions_collection.find({"job_id": job_id}).to_list(None)
+    except Exception as e:
+        print(f"Error fetching partitions of broadcast {job_id}: {e}")
+        return []
+
+async def count_open_partitions(job_id) -> Optional[int]:
+    """Count partitions of a job that still have users to send to (None if the count failed)."""
+    try:
+        return await broadcast_partitions_collection.count_documents({"job_id": job_id, "status": {"$ne": "done"}})
+    except Exception as e:
+        print(f"Error counting partitions of broadcast {job_id}: {e}")
+        return None
+
+async def get_broadcasts(statuses: List[str]) -> list:
+    """Get broadcast jobs in the given states, newest first."""
+    try:
+        return await broadcasts_collection.find({"status": {"$in": statuses}}).sort("created_at", -1).to_list(None)
+    except Exception as e:
+        print(f"Error fetching broadcasts: {e}")
+        return []
+
+def incr_stat(field: str, amount: int = 1, daily: bool = False):
+    """Bump a counter in memory; run_stats_flusher() writes it with a single $inc."""
+    _pending_stats[("global", field)] += amount
+    if daily:
+        _pending_stats[(f"day:{datetime.utcnow():%Y-%m-%d}", field)] += amount
+
+async def flush_stats():
+    """Write pending counter increments, one update per stats document."""
+    if not _pending_stats:
+        return
+    pending = dict(_pending_stats)
+    _pending_stats.clear()
+    by_doc = {}
+    for (doc_id, field), amount in pending.items():
+        by_doc.setdefault(doc_id, {})[field] = amount
+    for doc_id, increments in by_doc.items():
+        try:
+            await stats_collection.update_one({"_id": doc_id}, {"$inc": increments}, upsert=True)
+        except Exception as e:
+            print(f"Error flushing stats for {doc_id}: {e}")
+            for field, amount in increments.items():
+                _pending_stats[(doc_id, field)] += amount
+
+async def run_stats_flusher():
+    while True:
+        await asyncio.sleep(STATS_FLUSH_INTERVAL)
+        await flush_stats()
+
+async def init_stats():
+    """Seed total_users once from a full count; afterwards it is only ever incremented."""
+    try:
+        existing = await stats_collection.find_one({"_id": "global"}, projection={"total_users": 1})
+        if existing and "total_users" in existing:
+            return
+        total = await user_data.count_documents({})
+        await stats_collection.update_one(
+            {"_id": "global", "total_users": {"$exists": False}},
+            {"$set": {"total_users": total}},
+            upsert=True
+        )
+    except Exception as e:
+        print(f"Error initialising stats: {e}")
+
+async def get_stats() -> dict:
+    """Global counters plus today's, including increments not flushed yet."""
+    today = f"day:{datetime.utcnow():%Y-%m-%d}"
+    stats = {"global": {}, "today": {}}
+    try:
+        async for doc in stats_collection.find({"_id": {"$in": ["global", today]}}):
+            stats["global" if doc["_id"] == "global" else "today"] = doc
+    except Exception as e:
+        print(f"Error fetching stats: {e}")
+    for (doc_id, field), amount in _pending_stats.items():
+        if doc_id == "global":
+            stats["global"][field] = stats["global"].get(field, 0) + amount
+        elif doc_id == today:
+            stats["today"][field] = stats["today"].get(field, 0) + amount
+    return stats
@@ -2,6 +2,15 @@
 import base64
 import re
 import asyncio
+import hmac
+import hashlib
+import time
+import os
+import csv
+import json
+import tempfile
+from collections import defaultdict, deque
+from typing import Optional, Tuple
 from pyrogram import filters
 from pyrogram.enums import ChatMemberStatus
 from config import ADMINS
@@ -9,19 +18,19 @@ from pyrogram.errors.exceptions.bad_request_400 import UserNotParticipant
 from pyrogram.errors import FloodWait
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from pyrogram.filters import Filter
-from config import OWNER_ID
-from database.database import is_admin
+from config import OWNER_ID, LINK_SECRET
+from database.database import is_cached_admin
 
 class IsAdmin(Filter):
     async def __call__(self, client, message):
-        return await is_admin(message.from_user.id)
+        return is_cached_admin(message.from_user.id)
 
 is_admin_filter = IsAdmin()
 
 class IsOwnerOrAdmin(Filter):
     async def __call__(self, client, message):
         user_id = message.from_user.id
-        return user_id == OWNER_ID or await is_admin(user_id)
+        return user_id == OWNER_ID or is_cached_admin(user_id)
 
 is_owner_or_admin = IsOwnerOrAdmin()
 
@@ -38,6 +47,170 @@ async def decode(base64_string):
     string = string_bytes.decode("ascii")
     return string
 
+# Signed deep-link tokens: "s" + base62(channel id, sign, mode) + base62(40-bit HMAC).
+# They verify and decode locally, so /start never needs the database to find the channel.
+BASE62_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+SIGNED_TOKEN_PREFIX = "s"
+SIGNATURE_LENGTH = 7  # 62**7 > 2**40
+
+def _base62_encode(number: int) -> str:
+    if number == 0:
+        return BASE62_ALPHABET[0]
+    chars = []
+    while number:
+        number, rem = divmod(number, 62)
+        chars.append(BASE62_ALPHABET[rem])
+    return "".join(reversed(chars))
+
+def _base62_decode(text: str) -> int:
+    number = 0
+    for char in text:
+        number = number * 62 + BASE62_ALPHABET.index(char)
+    return number
+
+def _token_signature(value: int) -> str:
+    digest = hmac.new(LINK_SECRET.encode(), str(value).encode(), hashlib.sha256).digest()
+    return _base62_encode(int.from_bytes(digest[:5], "big")).rjust(SIGNATURE_LENGTH, BASE62_ALPHABET[0])
+
+def make_signed_token(channel_id: int, is_request: bool = False) -> str:
+    value = (abs(channel_id) << 2) | (int(channel_id < 0) << 1) | int(is_request)
+    return SIGNED_TOKEN_PREFIX + _base62_encode(value) + _token_signature(value)
+
+def parse_signed_token(token: str) -> Optional[Tuple[int, bool]]:
+    """Return (channel_id, is_request) for a valid signed token, None for anything else."""
+    if not token.startswith(SIGNED_TOKEN_PREFIX) or len(token) <= len(SIGNED_TOKEN_PREFIX) + SIGNATURE_LENGTH:
+        return None
+    body = token[len(SIGNED_TOKEN_PREFIX):]
+    value_part, signature = body[:-SIGNATURE_LENGTH], body[-SIGNATURE_LENGTH:]
+    try:
+        value = _base62_decode(value_part)
+    except ValueError:
+        return None
+    if not hmac.compare_digest(signature.encode(), _token_signature(value).encode()):
+        return None
+    channel_id = value >> 2
+    if value & 2:
+        channel_id = -channel_id
+    return channel_id, bool(value & 1)
+
+def channel_deep_links(bot_username: str, channel_id: int) -> Tuple[str, str]:
+    """Normal and request deep links for a channel."""
+    return (
+        f"https://t.me/{bot_username}?start={make_signed_token(channel_id)}",
+        f"https://t.me/{bot_username}?start={make_signed_token(channel_id, True)}"
+    )
+
+async def gather_bounded(items, func, limit: int = 5) -> list:
+    """Await func(item) for every item with at most `limit` running at once.
+    Results come back in input order, with exceptions returned in place."""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(item):
+        async with semaphore:
+            return await func(item)
+
+    return await asyncio.gather(*(run(item) for item in items), return_exceptions=True)
+
+LINK_FILE_FIELDS = ["channel_id", "title", "normal_link", "request_link", "status", "error"]
+
+class LinkFileWriter:
+    """Writes link rows to a temporary CSV or JSON file one at a time, so memory stays flat."""
+
+    def __init__(self, fmt: str = "csv", fields: list = LINK_FILE_FIELDS):
+        self.fmt = fmt
+        self.count = 0
+        fd, self.path = tempfile.mkstemp(suffix=f".{fmt}")
+        self.file = os.fdopen(fd, "w", newline="", encoding="utf-8")
+        if fmt == "csv":
+            self.writer = csv.DictWriter(self.file, fieldnames=fields, extrasaction="ignore")
+            self.writer.writeheader()
+        else:
+            self.fields = fields
+            self.file.write("[\n")
+
+    def write(self, row: dict):
+        if self.fmt == "csv":
+            self.writer.writerow(row)
+        else:
+            record = {field: row.get(field) for field in self.fields}
+            self.file.write((",\n" if self.count else "") + json.dumps(record, ensure_ascii=False))
+        self.count += 1
+
+    def close(self) -> str:
+        """Finish the file and return its path. The caller removes it once sent."""
+        if self.fmt != "csv":
+            self.file.write("\n]\n")
+        self.file.close()
+        return self.path
+
+class LatencyTracker:
+    """Keeps the most recent timings per stage and reports percentiles."""
+
+    def __init__(self, max_samples: int = 1000):
+        self.samples = defaultdict(lambda: deque(maxlen=max_samples))
+
+    def record(self, stage: str, started: float) -> float:
+        """Record the time since `started` (a time.perf_counter() value) and return now."""
+        now = time.perf_counter()
+        self.samples[stage].append(now - started)
+        return now
+
+    def percentile(self, stage: str, pct: float) -> float:
+        values = sorted(self.samples.get(stage, ()))
+        if not values:
+            return 0.0
+        return values[min(len(values) - 1, int(len(values) * pct))]
+
+    def summary(self) -> str:
+        return "\n".join(
+            f"{stage}: p50 {self.percentile(stage, 0.5) * 1000:.1f} ms, p99 {self.percentile(stage, 0.99) * 1000:.1f} ms"
+            for stage in self.samples
+        )
+
+class TokenBucket:
+    """Async token bucket shared by many senders.
+
+    pause() stops every caller at once, which is how a FloodWait should be
+    honoured: Telegram throttles the bot, not the one coroutine that hit it.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    self.tokens = 0
+                    self.updated = time.monotonic()
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+def format_stats(stats: dict) -> str:
+    """Render the counters returned by get_stats()."""
+    total, today = stats["global"], stats["today"]
+    return (
+        f"Users: {total.get('total_users', 0)} (+{today.get('new_users', 0)} today)\n\n"
+        f"Links Issued: {total.get('links_issued', 0)} ({today.get('links_issued', 0)} today)\n"
+        f"Requests Approved: {total.get('join_requests_approved', 0)} ({today.get('join_requests_approved', 0)} today)\n"
+        f"Broadcasts Sent: {total.get('broadcasts_sent', 0)} ({total.get('broadcast_messages', 0)} messages)"
+    )
+
 def get_readable_time(seconds: int) -> str:
     count = 0
     up_time = ""
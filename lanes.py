@@ -0,0 +1,95 @@
+import asyncio
+import functools
+import time
+from config import LANE_CALLBACK_WORKERS, LANE_JOIN_REQUEST_WORKERS, LANE_ADMIN_WORKERS, LANE_BULK_WORKERS
+from helper_func import LatencyTracker
+
+
+class Lane:
+    """A queue of handler calls served by a fixed number of workers.
+
+    Slow handlers are moved off pyrogram's shared worker pool into lanes, so a
+    join-request surge or a long broadcast can only fill its own lane and
+    /start deep links always find a free pyrogram worker.
+    """
+
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = workers
+        self.running = 0
+        self.processed = 0
+        self.failed = 0
+        self.latency = LatencyTracker()
+        self.queue = None
+        self._tasks = []
+
+    @property
+    def queue_length(self) -> int:
+        return self.queue.qsize() if self.queue else 0
+
+    def submit(self, func, *args):
+        # Workers start with the first call, inside the running event loop
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self.queue.put_nowait((time.perf_counter(), func, args))
+
+    async def _worker(self):
+        while True:
+            enqueued, func, args = await self.queue.get()
+            started = self.latency.record("wait", enqueued)
+            self.running += 1
+            try:
+                await func(*args)
+            except Exception as e:
+                self.failed += 1
+                print(f"Error in {self.name} lane handler {func.__name__}: {e}")
+            finally:
+                self.running -= 1
+                self.processed += 1
+                self.latency.record("run", started)
+                self.queue.task_done()
+
+    def telemetry(self) -> dict:
+        return {
+            "lane": self.name,
+            "workers": self.workers,
+            "queued": self.queue_length,
+            "running": self.running,
+            "processed": self.processed,
+            "failed": self.failed,
+            "wait_p50_ms": round(self.latency.percentile("wait", 0.5) * 1000, 1),
+            "wait_p99_ms": round(self.latency.percentile("wait", 0.99) * 1000, 1),
+        }
+
+
+# Highest priority first; /start itself stays on pyrogram's own workers
+lanes = {
+    "callbacks": Lane("callbacks", LANE_CALLBACK_WORKERS),
+    "join_requests": Lane("join_requests", LANE_JOIN_REQUEST_WORKERS),
+    "admin": Lane("admin", LANE_ADMIN_WORKERS),
+    "bulk": Lane("bulk", LANE_BULK_WORKERS),
+}
+
+
+def offload(lane_name: str):
+    """Run the decorated handler in a lane instead of on pyrogram's worker pool.
+
+    Goes below the @Bot.on_... decorator; the pyrogram worker only enqueues the call.
+    """
+    lane = lanes[lane_name]
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(client, update):
+            lane.submit(func, client, update)
+        return wrapper
+    return decorator
+
+
+def lanes_status_text() -> str:
+    return "\n".join(
+        f"{lane.name}: {lane.queue_length} queued, {lane.running}/{lane.workers} busy, "
+        f"wait p99 {lane.latency.percentile('wait', 0.99) * 1000:.0f} ms"
+        for lane in lanes.values()
+    )
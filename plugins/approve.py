@@ -3,22 +3,20 @@ import os
 import asyncio
 from config import *
 from pyrogram import Client, filters
-from pyrogram.types import Message, User, ChatJoinRequest, InlineKeyboardMarkup, InlineKeyboardButton
+from pyrogram import enums
+from pyrogram.types import Message, User, ChatJoinRequest, ChatMemberUpdated, InlineKeyboardMarkup, InlineKeyboardButton
 from pyrogram.errors import FloodWait, ChatAdminRequired, RPCError, UserNotParticipant
-from database.database import set_approval_off, is_approval_off
+from database.database import set_approval_off, is_approval_off, get_setting, set_setting
 from helper_func import *
-
-# Default settings
-APPROVAL_WAIT_TIME = 5  # seconds 
-AUTO_APPROVE_ENABLED = True  # Toggle for enabling/disabling auto approval 
+from approvals import approval_queue, drain_report_text
+from lanes import offload
 
 # Removed UserClient dependency - not needed for auto-approval
 
 @Client.on_chat_join_request((filters.group | filters.channel) & filters.chat(CHAT_ID) if CHAT_ID else (filters.group | filters.channel))
+@offload("join_requests")
 async def autoapprove(client, message: ChatJoinRequest):
-    global AUTO_APPROVE_ENABLED
-
-    if not AUTO_APPROVE_ENABLED:
+    if not get_setting("auto_approve_enabled"):
         return
 
     chat = message.chat
@@ -29,75 +27,37 @@ async def autoapprove(client, message: ChatJoinRequest):
         print(f"Auto-approval is OFF for channel {chat.id}")
         return
 
-    print(f"🔄 {user.first_name} ({user.id}) requested to join {chat.title} ({chat.id})")
-    print(f"📋 Auto-approval enabled: {AUTO_APPROVE_ENABLED}")
-    print(f"⏱️  Waiting {APPROVAL_WAIT_TIME} seconds before approval...")
-    
-    await asyncio.sleep(APPROVAL_WAIT_TIME)
-
-    # Check if user is already a participant before approving
-    try:
-        member = await client.get_chat_member(chat.id, user.id)
-        if member.status in ["member", "administrator", "creator"]:
-            print(f"User {user.id} is already a participant of {chat.id}, skipping approval.")
-            return
-    except UserNotParticipant:
-        # User is not a member, proceed with approval
-        pass
-    except Exception as e:
-        print(f"Error checking member status: {e}")
+    # Queue the request and return at once; the approval queue waits out the approval time
+    approval_queue.add(chat, user, get_setting("approval_wait_time"))
 
-    try:
-        await client.approve_chat_join_request(chat_id=chat.id, user_id=user.id)
-        print(f"Successfully approved {user.first_name} ({user.id}) for {chat.title}")
-    except Exception as e:
-        print(f"Error approving join request: {e}")
+@Client.on_chat_member_updated((filters.group | filters.channel) & filters.chat(CHAT_ID) if CHAT_ID else (filters.group | filters.channel))
+async def bot_rights_changed(client, update: ChatMemberUpdated):
+    member = update.new_chat_member or update.old_chat_member
+    if not member or member.user.id != client.me.id:
         return
-    
-    if APPROVED == "on":
-        invite_link = await client.export_chat_invite_link(chat.id)
-        buttons = [
-            [InlineKeyboardButton('🔥 ᴊᴏɪɴ ᴍʏ ᴜᴘᴅᴀᴛᴇs ᴄʜᴀɴɴᴇʟ', url='https://t.me/PR_ALL_BOT')],
-            [InlineKeyboardButton(f'• ᴊᴏɪɴ {chat.title} •', url=invite_link)]
-        ]
-        markup = InlineKeyboardMarkup(buttons)
-        caption = f"<b>ʜᴇʏ {user.mention()},\n\n<blockquote> ʏᴏᴜʀ ʀᴇǫᴜᴇsᴛ ᴛᴏ ᴊᴏɪɴ _{chat.title} ʜᴀs ʙᴇᴇɴ ᴀᴘᴘʀᴏᴠᴇᴅ.</blockquote> </b>"
-        
-        try:
-            await client.send_photo(
-                chat_id=user.id,
-                photo=START_PIC,
-                caption=caption,
-                reply_markup=markup
-            )
-        except Exception as e:
-            print(f"Error sending approval photo: {e}")
-            await client.send_message(
-                chat_id=user.id,
-                text=caption,
-                reply_markup=markup
-            )
+    # Without admin rights the stored welcome link can't be checked or replaced
+    if not update.new_chat_member or member.status not in (enums.ChatMemberStatus.ADMINISTRATOR, enums.ChatMemberStatus.OWNER):
+        await approval_queue.forget_welcome_link(update.chat.id)
 
 @Client.on_message(filters.command("reqtime") & is_owner_or_admin)
 async def set_reqtime(client, message: Message):
-    global APPROVAL_WAIT_TIME
-    
     if len(message.command) != 2 or not message.command[1].isdigit():
         return await message.reply_text("Usage: <code>/reqtime {seconds}</code>")
     
-    APPROVAL_WAIT_TIME = int(message.command[1])
-    await message.reply_text(f"✅ Request approval time set to <b>{APPROVAL_WAIT_TIME}</b> seconds.")
+    wait_time = int(message.command[1])
+    if not await set_setting("approval_wait_time", wait_time):
+        return await message.reply_text("❌ Failed to save the request approval time.")
+    await message.reply_text(f"✅ Request approval time set to <b>{wait_time}</b> seconds.")
 
 @Client.on_message(filters.command("reqmode") & is_owner_or_admin)
 async def toggle_reqmode(client, message: Message):
-    global AUTO_APPROVE_ENABLED
-    
     if len(message.command) != 2 or message.command[1].lower() not in ["on", "off"]:
         return await message.reply_text("Usage: <code>/reqmode on</code> or <code>/reqmode off</code>")
     
     mode = message.command[1].lower()
-    AUTO_APPROVE_ENABLED = (mode == "on")
-    status = "enabled ✅" if AUTO_APPROVE_ENABLED else "disabled ❌"
+    if not await set_setting("auto_approve_enabled", mode == "on"):
+        return await message.reply_text("❌ Failed to save the auto-approval mode.")
+    status = "enabled ✅" if mode == "on" else "disabled ❌"
     await message.reply_text(f"Auto-approval has been {status}.")
 
 @Client.on_message(filters.command("approveoff") & is_owner_or_admin)
@@ -121,3 +81,12 @@ async def approve_on_command(client, message: Message):
         await message.reply_text(f"✅ Auto-approval is now <b>ON</b> for channel <code>{channel_id}</code>.")
     else:
         await message.reply_text(f"❌ Failed to set auto-approval ON for channel <code>{channel_id}</code>.")
+
+@Client.on_message(filters.command("drainrequests") & is_owner_or_admin)
+@offload("bulk")
+async def drain_requests_command(client, message: Message):
+    status_msg = await message.reply_text("<i>Approving pending join requests...</i>")
+    report = await approval_queue.drain_pending(client)
+    if report is None:
+        return await status_msg.edit_text("A drain is already running.")
+    await status_msg.edit_text(f"✅ {drain_report_text(report)}")
@@ -1,34 +1,153 @@
  
 import asyncio
 import base64
+import os
+import re
+import time
+from collections import defaultdict
 from bot import Bot
 from pyrogram import Client, filters
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton, Message
 from pyrogram.errors import UserNotParticipant, FloodWait, ChatAdminRequired, RPCError
 from pyrogram.errors import InviteHashExpired, InviteRequestSent
-from database.database import save_channel, delete_channel, get_channels
+from database.database import save_channel, delete_channel, get_channel_page, count_channels
 from config import *
 from database.database import *
 from helper_func import *
+from scheduler import scheduler
+from lanes import offload
+from approvals import approval_queue
 from datetime import datetime, timedelta
+from typing import Optional
 
 PAGE_SIZE = 6
-
-# Revoke invite link after 5-10 minutes
-async def revoke_invite_after_5_minutes(client: Bot, channel_id: int, link: str, is_request: bool = False):
-    await asyncio.sleep(300)  # 10 minutes
+# get_chat / database calls in flight at once while rendering a listing page
+PAGE_FETCH_CONCURRENCY = 5
+# /bulklink replies longer than this are sent as a file instead
+MAX_MESSAGE_LENGTH = 4096
+BULK_FILE_MAX_SIZE = 1024 * 1024
+page_latency = LatencyTracker()
+
+# Shared invite link pool: (channel_id, is_request) -> {"invite_link": str, "expire_date": datetime}
+# Every user clicking the same post gets the same live link, so Telegram is only
+# hit when a link gets too old to give a user INVITE_LINK_MIN_VALIDITY seconds.
+invite_link_pool = {}
+_pool_locks = defaultdict(asyncio.Lock)
+_pool_rotating = set()
+
+# channel_id -> monotonic time until which a chat whose get_chat failed isn't looked up again
+_chat_lookup_failures = {}
+# get_chat is not called until this monotonic time after a FloodWait
+_chat_lookup_flood_until = 0.0
+
+def _link_time_left(entry) -> float:
+    if not entry:
+        return 0
+    return (entry["expire_date"] - datetime.now()).total_seconds()
+
+async def _mint_invite_link(client: Bot, channel_id: int, is_request: bool) -> dict:
+    key = (channel_id, is_request)
+    expire_date = datetime.now() + timedelta(seconds=INVITE_LINK_LIFETIME)
+    invite = await client.create_chat_invite_link(
+        chat_id=channel_id,
+        expire_date=expire_date,
+        creates_join_request=is_request
+    )
+    entry = {"invite_link": invite.invite_link, "expire_date": expire_date}
+    # The replaced link is not revoked: users who just got it keep it, and Telegram
+    # expires it at its expire_date
+    invite_link_pool[key] = entry
+    await save_invite_link(channel_id, invite.invite_link, is_request, expire_date)
+    return entry
+
+async def _rotate_invite_link(client: Bot, channel_id: int, is_request: bool):
+    key = (channel_id, is_request)
     try:
-        if is_request:
-            await client.revoke_chat_invite_link(channel_id, link)
-            print(f"Jᴏɪɴ ʀᴇǫᴜᴇsᴛ ʟɪɴᴋ ʀᴇᴠᴏᴋᴇᴅ ғᴏʀ ᴄʜᴀɴɴᴇʟ {channel_id}")
-        else:
-            await client.revoke_chat_invite_link(channel_id, link)
-            print(f"Iɴᴠɪᴛᴇ ʟɪɴᴋ ʀᴇᴠᴏᴋᴇᴅ ғᴏʀ ᴄʜᴀɴɴᴇʟ {channel_id}")
+        async with _pool_locks[key]:
+            if _link_time_left(invite_link_pool.get(key)) < INVITE_LINK_MIN_VALIDITY + INVITE_LINK_ROTATE_AHEAD:
+                await _mint_invite_link(client, channel_id, is_request)
     except Exception as e:
-        print(f"Fᴀɪʟᴇᴅ ᴛᴏ ʀᴇᴠᴏᴋᴇ ɪɴᴠɪᴛᴇ ғᴏʀ ᴄʜᴀɴɴᴇʟ {channel_id}: {e}")
+        print(f"Failed to rotate invite link for channel {channel_id}: {e}")
+    finally:
+        _pool_rotating.discard(key)
+
+async def get_pooled_invite_link(client: Bot, channel_id: int, is_request: bool = False) -> str:
+    """Return a live invite link for the channel, minting one only when the pooled link is too old."""
+    key = (channel_id, is_request)
+    entry = invite_link_pool.get(key)
+    time_left = _link_time_left(entry)
+
+    if time_left > INVITE_LINK_MIN_VALIDITY:
+        # Still good to hand out; mint the successor in the background before it goes stale
+        if time_left < INVITE_LINK_MIN_VALIDITY + INVITE_LINK_ROTATE_AHEAD and key not in _pool_rotating:
+            _pool_rotating.add(key)
+            asyncio.create_task(_rotate_invite_link(client, channel_id, is_request))
+        return entry["invite_link"]
+
+    # Cold or stale: one caller mints, everyone else waiting on the lock reuses its link
+    async with _pool_locks[key]:
+        entry = invite_link_pool.get(key)
+        if _link_time_left(entry) <= INVITE_LINK_MIN_VALIDITY:
+            entry = await _mint_invite_link(client, channel_id, is_request)
+    return entry["invite_link"]
+
+def seed_pooled_invite_link(channel_id: int, is_request: bool, invite_link: str, expire_date: datetime):
+    """Adopt a link already minted (e.g. before a restart) if the pool has nothing better."""
+    key = (channel_id, is_request)
+    entry = {"invite_link": invite_link, "expire_date": expire_date}
+    if _link_time_left(entry) > _link_time_left(invite_link_pool.get(key)):
+        invite_link_pool[key] = entry
+
+async def drop_pooled_invite_links(channel_id: int):
+    """Forget pooled links for a channel (e.g. after /delch) and revoke them, since nothing else will."""
+    for is_request in (False, True):
+        entry = invite_link_pool.pop((channel_id, is_request), None)
+        if entry:
+            await scheduler.schedule(
+                "revoke_link",
+                0,
+                chat_id=channel_id,
+                invite_link=entry["invite_link"],
+                is_request=is_request
+            )
+
+async def fetch_chat_infos(client: Bot, channel_ids: list) -> dict:
+    """Display metadata for channels, from cache where possible. Failed lookups are left out.
+
+    While get_chat is under a FloodWait, channels not in the cache get a placeholder
+    title instead of holding the page until the wait is over.
+    """
+    infos = await get_chat_infos(channel_ids)
+    now = time.monotonic()
+    missing = [channel_id for channel_id in channel_ids
+               if channel_id not in infos and _chat_lookup_failures.get(channel_id, 0) <= now]
+
+    async def lookup(channel_id):
+        global _chat_lookup_flood_until
+        if time.monotonic() < _chat_lookup_flood_until:
+            return None
+        try:
+            chat = await client.get_chat(channel_id)
+        except FloodWait as e:
+            _chat_lookup_flood_until = time.monotonic() + e.value
+            return None
+        await save_chat_info(channel_id, chat.title, chat.username)
+        return {"title": chat.title, "username": chat.username}
+
+    for channel_id, info in zip(missing, await gather_bounded(missing, lookup, PAGE_FETCH_CONCURRENCY)):
+        if info is None:
+            infos[channel_id] = {"title": f"Channel {channel_id}", "username": None}
+        elif isinstance(info, Exception):
+            print(f"Error fetching chat {channel_id}: {info}")
+            _chat_lookup_failures[channel_id] = time.monotonic() + CHAT_INFO_FAILURE_TTL
+        else:
+            _chat_lookup_failures.pop(channel_id, None)
+            infos[channel_id] = info
+    return infos
 
 # channel add cmnd
 @Bot.on_message(filters.command('addch') & is_owner_or_admin)
+@offload("admin")
 async def set_channel(client: Bot, message: Message):
     try:
         channel_id = int(message.command[1])
@@ -41,15 +160,13 @@ async def set_channel(client: Bot, message: Message):
         if chat.permissions and not (chat.permissions.can_post_messages or chat.permissions.can_edit_messages):
             return await message.reply(f"<b><blockquote expandable>I ᴀᴍ ɪɴ {chat.title}, ʙᴜᴛ I ʟᴀᴄᴋ ᴘᴏsᴛɪɴɢ ᴏʀ ᴇᴅɪᴛɪɴɢ ᴘᴇʀᴍɪssɪᴏɴs.</b>")
         
-        # Generate encoded link for the channel
-        import base64
-        encoded_link = base64.urlsafe_b64encode(str(channel_id).encode()).decode()
-        await save_channel(channel_id, encoded_link)
-        base64_invite = await save_encoded_link(channel_id)
-        normal_link = f"https://t.me/{client.username}?start={base64_invite}"
-        base64_request = await encode(str(channel_id))
-        await save_encoded_link2(channel_id, base64_request)
-        request_link = f"https://t.me/{client.username}?start=req_{base64_request}"
+        await save_channel(channel_id)
+        await save_chat_info(channel_id, chat.title, chat.username)
+        # Keep the legacy tokens stored so links shared before signed tokens still resolve
+        await save_encoded_link(channel_id)
+        await save_encoded_link2(channel_id, await encode(str(channel_id)))
+        invalidate_link_cache(channel_id)
+        normal_link, request_link = channel_deep_links(client.username, channel_id)
         reply_text = (
             f"<b><blockquote expandable>✅ Cʜᴀɴɴᴇʟ {chat.title} ({channel_id}) ʜᴀs ʙᴇᴇɴ ᴀᴅᴅᴇᴅ sᴜᴄᴄᴇssғᴜʟʟʏ.</b>\n\n"
             f"<b>🔗 Nᴏʀᴍᴀʟ Lɪɴᴋ:</b> <code>{normal_link}</code>\n"
@@ -76,47 +193,82 @@ async def del_channel(client: Bot, message: Message):
         return await message.reply("<b><blockquote expandable>Iɴᴠᴀʟɪᴅ ᴄʜᴀɴɴᴇʟ ID. Exᴀᴍᴘʟᴇ: <code>/delch &lt;channel_id&gt;</code></b>")
     
     await delete_channel(channel_id)
+    await drop_pooled_invite_links(channel_id)
+    await approval_queue.forget_welcome_link(channel_id)
+    invalidate_link_cache(channel_id)
     return await message.reply(f"<b><blockquote expandable>❌ Cʜᴀɴɴᴇʟ {channel_id} ʜᴀs ʙᴇᴇɴ ʀᴇᴍᴏᴠᴇᴅ sᴜᴄᴄᴇssғᴜʟʟʏ.</b>")
 
+async def load_channel_page(page: int, page_size: int, direction: Optional[str] = None, key: Optional[int] = None):
+    """Fetch one listing page by keyset: ids after `key` for "n", ids before it for "p".
+
+    Returns (channel_ids, page, total_pages, has_prev, has_next).
+    """
+    channels, more = await get_channel_page(
+        page_size,
+        after=key if direction == "n" else None,
+        before=key if direction == "p" else None
+    )
+    if channels is None:
+        # The boundary channel was removed after these buttons were sent; start over
+        channels, more = await get_channel_page(page_size)
+        page, direction = 0, None
+    if direction == "p":
+        has_prev, has_next = more, True
+        if not more:
+            page = 0
+    else:
+        has_prev, has_next = page > 0, more
+    total_pages = max(1, (await count_channels() + page_size - 1) // page_size)
+    return channels, page, total_pages, has_prev, has_next
+
+def page_nav_buttons(prefix: str, page: int, channels: list, has_prev: bool, has_next: bool) -> list:
+    """Previous/next buttons carrying the boundary channel id of the current page."""
+    nav_buttons = []
+    if has_prev and channels:
+        nav_buttons.append(InlineKeyboardButton("• Pʀᴇᴠɪᴏᴜs •", callback_data=f"{prefix}_{max(page - 1, 0)}_p_{channels[0]}"))
+    if has_next and channels:
+        nav_buttons.append(InlineKeyboardButton("• Nᴇxᴛ •", callback_data=f"{prefix}_{page + 1}_n_{channels[-1]}"))
+    return nav_buttons
+
+def parse_page_callback(data: str):
+    """Split "prefix_page_direction_key" into (page, direction, key).
+    Buttons sent before keyset pagination only carry a page number and restart from the first page."""
+    parts = data.split("_")
+    if len(parts) == 4:
+        return int(parts[1]), parts[2], int(parts[3])
+    return 0, None, None
+
 # Channel post command
 @Bot.on_message(filters.command('ch_links') & is_owner_or_admin)
+@offload("admin")
 async def channel_post(client: Bot, message: Message):
-    channels = await get_channels()
-    if not channels:
+    if not await count_channels():
         return await message.reply("<b><blockquote expandable>Nᴏ ᴄʜᴀɴɴᴇʟs ᴀʀᴇ ᴀᴠᴀɪʟᴀʙʟᴇ. Pʟᴇᴀsᴇ ᴜsᴇ /addch ᴛᴏ ᴀᴅᴅ ᴀ ᴄʜᴀɴɴᴇʟ.</b>")
 
-    await send_channel_page(client, message, channels, page=0)
+    await send_channel_page(client, message, page=0)
 
-async def send_channel_page(client, message, channels, page, edit=False):
-    total_pages = (len(channels) + PAGE_SIZE - 1) // PAGE_SIZE
-    start_idx = page * PAGE_SIZE
-    end_idx = start_idx + PAGE_SIZE
+async def send_channel_page(client, message, page, direction=None, key=None, edit=False):
     buttons = []
+    started = time.perf_counter()
+
+    page_channels, page, total_pages, has_prev, has_next = await load_channel_page(page, PAGE_SIZE, direction, key)
+    infos = await fetch_chat_infos(client, page_channels)
 
     row = []
-    for channel_id in channels[start_idx:end_idx]:
-        try:
-            base64_invite = await save_encoded_link(channel_id)
-            button_link = f"https://t.me/{client.username}?start={base64_invite}"
-            chat = await client.get_chat(channel_id)
-            
-            row.append(InlineKeyboardButton(chat.title, url=button_link))
-            
-            if len(row) == 2:
-                buttons.append(row)
-                row = [] 
-        except Exception as e:
-            print(f"Error for channel {channel_id}: {e}")
+    for channel_id in page_channels:
+        if channel_id not in infos:
+            continue
+        button_link, _ = channel_deep_links(client.username, channel_id)
+        row.append(InlineKeyboardButton(infos[channel_id]["title"], url=button_link))
+        if len(row) == 2:
+            buttons.append(row)
+            row = []
 
     if row: 
         buttons.append(row)
+    page_latency.record("ch_links", started)
 
-    nav_buttons = []
-    if page > 0:
-        nav_buttons.append(InlineKeyboardButton("• Pʀᴇᴠɪᴏᴜs •", callback_data=f"channelpage_{page-1}"))
-    if page < total_pages - 1:
-        nav_buttons.append(InlineKeyboardButton("• Nᴇxᴛ •", callback_data=f"channelpage_{page+1}"))
-
+    nav_buttons = page_nav_buttons("channelpage", page, page_channels, has_prev, has_next)
     if nav_buttons:
         buttons.append(nav_buttons)
 
@@ -127,51 +279,42 @@ async def send_channel_page(client, message, channels, page, edit=False):
         await message.reply("Sᴇʟᴇᴄᴛ ᴀ ᴄʜᴀɴɴᴇʟ ᴛᴏ ᴀᴄᴄᴇss:", reply_markup=reply_markup)
 
 @Bot.on_callback_query(filters.regex(r"channelpage_(\d+)"))
+@offload("callbacks")
 async def paginate_channels(client, callback_query):
-    page = int(callback_query.data.split("_")[1])
-    channels = await get_channels()
-    await send_channel_page(client, callback_query.message, channels, page, edit=True)
+    page, direction, key = parse_page_callback(callback_query.data)
+    await send_channel_page(client, callback_query.message, page, direction, key, edit=True)
 
 # Request post command
 @Bot.on_message(filters.command('reqlink') & is_owner_or_admin)
+@offload("admin")
 async def req_post(client: Bot, message: Message):
-    channels = await get_channels()
-    if not channels:
+    if not await count_channels():
         return await message.reply("<b><blockquote expandable>Nᴏ ᴄʜᴀɴɴᴇʟs ᴀʀᴇ ᴀᴠᴀɪʟᴀʙʟᴇ. Pʟᴇᴀsᴇ ᴜsᴇ /setchannel ᴛᴏ ᴀᴅᴅ ᴀ ᴄʜᴀɴɴᴇʟ</b>")
 
-    await send_request_page(client, message, channels, page=0)
+    await send_request_page(client, message, page=0)
 
-async def send_request_page(client, message, channels, page, edit=False):
-    total_pages = (len(channels) + PAGE_SIZE - 1) // PAGE_SIZE
-    start_idx = page * PAGE_SIZE
-    end_idx = start_idx + PAGE_SIZE
+async def send_request_page(client, message, page, direction=None, key=None, edit=False):
     buttons = []
+    started = time.perf_counter()
 
-    row = []
-    for channel_id in channels[start_idx:end_idx]:
-        try:
-            base64_request = await encode(str(channel_id))
-            await save_encoded_link2(channel_id, base64_request)
-            button_link = f"https://t.me/{client.username}?start=req_{base64_request}"
-            chat = await client.get_chat(channel_id)
-
-            row.append(InlineKeyboardButton(chat.title, url=button_link))
+    page_channels, page, total_pages, has_prev, has_next = await load_channel_page(page, PAGE_SIZE, direction, key)
+    infos = await fetch_chat_infos(client, page_channels)
 
-            if len(row) == 2:
-                buttons.append(row)
-                row = [] 
-        except Exception as e:
-            print(f"Error generating request link for channel {channel_id}: {e}")
+    row = []
+    for channel_id in page_channels:
+        if channel_id not in infos:
+            continue
+        _, button_link = channel_deep_links(client.username, channel_id)
+        row.append(InlineKeyboardButton(infos[channel_id]["title"], url=button_link))
+        if len(row) == 2:
+            buttons.append(row)
+            row = []
 
     if row: 
         buttons.append(row)
+    page_latency.record("reqlink", started)
 
-    nav_buttons = []
-    if page > 0:
-        nav_buttons.append(InlineKeyboardButton("• Pʀᴇᴠɪᴏᴜs •", callback_data=f"reqpage_{page-1}"))
-    if page < total_pages - 1:
-        nav_buttons.append(InlineKeyboardButton("• Nᴇxᴛ •", callback_data=f"reqpage_{page+1}"))
-
+    nav_buttons = page_nav_buttons("reqpage", page, page_channels, has_prev, has_next)
     if nav_buttons:
         buttons.append(nav_buttons) 
     reply_markup = InlineKeyboardMarkup(buttons)
@@ -181,55 +324,43 @@ async def send_request_page(client, message, channels, page, edit=False):
         await message.reply("Sᴇʟᴇᴄᴛ ᴀ ᴄʜᴀɴɴᴇʟ ᴛᴏ ʀᴇǫᴜᴇsᴛ ᴀᴄᴄᴇss:", reply_markup=reply_markup)
 
 @Bot.on_callback_query(filters.regex(r"reqpage_(\d+)"))
+@offload("callbacks")
 async def paginate_requests(client, callback_query):
-    page = int(callback_query.data.split("_")[1])
-    channels = await get_channels()
-    await send_request_page(client, callback_query.message, channels, page, edit=True)
+    page, direction, key = parse_page_callback(callback_query.data)
+    await send_request_page(client, callback_query.message, page, direction, key, edit=True)
 
 # Links command - show all links as text
 @Bot.on_message(filters.command('links') & is_owner_or_admin)
+@offload("admin")
 async def show_links(client: Bot, message: Message):
-    channels = await get_channels()
-    if not channels:
+    if not await count_channels():
         return await message.reply("<b><blockquote expandable>Nᴏ ᴄʜᴀɴɴᴇʟs ᴀʀᴇ ᴀᴠᴀɪʟᴀʙʟᴇ. Pʟᴇᴀsᴇ ᴜsᴇ /addch ᴛᴏ ᴀᴅᴅ ᴀ ᴄʜᴀɴɴᴇʟ.</b>")
 
-    await send_links_page(client, message, channels, page=0)
+    await send_links_page(client, message, page=0)
 
-async def send_links_page(client, message, channels, page, edit=False):
-    total_pages = (len(channels) + PAGE_SIZE - 1) // PAGE_SIZE
-    start_idx = page * PAGE_SIZE
-    end_idx = start_idx + PAGE_SIZE
-    
+async def send_links_page(client, message, page, direction=None, key=None, edit=False):
     links_text = "<b>➤ Aʟʟ Cʜᴀɴɴᴇʟ Lɪɴᴋs:</b>\n\n"
     
-    for i, channel_id in enumerate(channels[start_idx:end_idx], start=start_idx + 1):
-        try:
-            chat = await client.get_chat(channel_id)
-            base64_invite = await save_encoded_link(channel_id)
-            normal_link = f"https://t.me/{client.username}?start={base64_invite}"
-            base64_request = await encode(str(channel_id))
-            await save_encoded_link2(channel_id, base64_request)
-            request_link = f"https://t.me/{client.username}?start=req_{base64_request}"
-            
-            links_text += f"<b>{i}. {chat.title}</b>\n"
-            links_text += f"<b>➥ Nᴏʀᴍᴀʟ:</b> <code>{normal_link}</code>\n"
-            links_text += f"<b>➤ Rᴇǫᴜᴇsᴛ:</b> <code>{request_link}</code>\n\n"
-            
-        except Exception as e:
-            print(f"Error for channel {channel_id}: {e}")
+    started = time.perf_counter()
+    page_channels, page, total_pages, has_prev, has_next = await load_channel_page(page, PAGE_SIZE, direction, key)
+    infos = await fetch_chat_infos(client, page_channels)
+
+    for i, channel_id in enumerate(page_channels, start=page * PAGE_SIZE + 1):
+        if channel_id not in infos:
             links_text += f"<b>{i}. Channel {channel_id}</b> (Error)\n\n"
+            continue
+        normal_link, request_link = channel_deep_links(client.username, channel_id)
+        links_text += f"<b>{i}. {infos[channel_id]['title']}</b>\n"
+        links_text += f"<b>➥ Nᴏʀᴍᴀʟ:</b> <code>{normal_link}</code>\n"
+        links_text += f"<b>➤ Rᴇǫᴜᴇsᴛ:</b> <code>{request_link}</code>\n\n"
+    page_latency.record("links", started)
 
     # Add pagination info
     links_text += f"<b>📄 Pᴀɢᴇ {page + 1} ᴏғ {total_pages}</b>"
     
     # Create navigation buttons
     buttons = []
-    nav_buttons = []
-    if page > 0:
-        nav_buttons.append(InlineKeyboardButton("• Pʀᴇᴠɪᴏᴜs •", callback_data=f"linkspage_{page-1}"))
-    if page < total_pages - 1:
-        nav_buttons.append(InlineKeyboardButton("• Nᴇxᴛ •", callback_data=f"linkspage_{page+1}"))
-
+    nav_buttons = page_nav_buttons("linkspage", page, page_channels, has_prev, has_next)
     if nav_buttons:
         buttons.append(nav_buttons)
     
@@ -241,40 +372,129 @@ async def send_links_page(client, message, channels, page, edit=False):
         await message.reply(links_text, reply_markup=reply_markup)
 
 @Bot.on_callback_query(filters.regex(r"linkspage_(\d+)"))
+@offload("callbacks")
 async def paginate_links(client, callback_query):
-    page = int(callback_query.data.split("_")[1])
-    channels = await get_channels()
-    await send_links_page(client, callback_query.message, channels, page, edit=True)
+    page, direction, key = parse_page_callback(callback_query.data)
+    await send_links_page(client, callback_query.message, page, direction, key, edit=True)
 
 # Bulk link generation command
 @Bot.on_message(filters.command('bulklink') & is_owner_or_admin)
+@offload("bulk")
 async def bulk_link(client: Bot, message: Message):
-    user_id = message.from_user.id
+    # Ids come inline, from a .txt file sent with /bulklink as caption, or from a file the command replies to
+    document = message.document or (message.reply_to_message.document if message.reply_to_message else None)
+    args = message.command[1:]
+    fmt = "json" if any(arg.lower() == "json" for arg in args) else "csv"
+    ids = [arg for arg in args if arg.lower() not in ("json", "csv")]
+
+    if document:
+        if document.file_size and document.file_size > BULK_FILE_MAX_SIZE:
+            return await message.reply("<b><blockquote expandable>Fɪʟᴇ ɪs ᴛᴏᴏ ʟᴀʀɢᴇ.</b>")
+        data = await client.download_media(document, in_memory=True)
+        ids += re.split(r"[\s,]+", bytes(data.getbuffer()).decode("utf-8", errors="ignore"))
+        ids = [id_str for id_str in ids if id_str]
+
+    if not ids:
+        return await message.reply(
+            "<b><blockquote expandable>ᴜsᴀɢᴇ: <code>/bulklink &lt;id1&gt; &lt;id2&gt; ...</code>\n"
+            "ᴏʀ sᴇɴᴅ/ʀᴇᴘʟʏ ᴛᴏ ᴀ .txt ғɪʟᴇ ᴏғ ɪᴅs ᴡɪᴛʜ <code>/bulklink [csv|json]</code></b>"
+        )
 
-    if len(message.command) < 2:
-        return await message.reply("<b><blockquote expandable>ᴜsᴀɢᴇ: <code>/bulklink &lt;id1&gt; &lt;id2&gt; ...</code></b>")
+    status_msg = await message.reply(f"<i>Resolving {len(ids)} ids...</i>") if len(ids) > PAGE_SIZE else None
+    started = time.perf_counter()
+    channel_ids = list(dict.fromkeys(int(id_str) for id_str in ids if re.fullmatch(r"-?\d+", id_str)))
+    infos = await fetch_chat_infos(client, channel_ids)
+    # Legacy tokens are only written for channels that don't have them yet
+    await backfill_encoded_links([channel_id for channel_id in channel_ids if channel_id in infos])
+
+    rows = []
+    for id_str in ids:
+        row = {"channel_id": id_str}
+        if not re.fullmatch(r"-?\d+", id_str):
+            row["error"] = "invalid id"
+        elif int(id_str) not in infos:
+            row["error"] = "chat not accessible"
+        else:
+            channel_id = int(id_str)
+            row["title"] = infos[channel_id]["title"]
+            row["normal_link"], row["request_link"] = channel_deep_links(client.username, channel_id)
+        rows.append(row)
+    page_latency.record("bulklink", started)
 
-    ids = message.command[1:]
     reply_text = "<b>➤ Bᴜʟᴋ Lɪɴᴋ Gᴇɴᴇʀᴀᴛɪᴏɴ:</b>\n\n"
-    for idx, id_str in enumerate(ids, start=1):
+    for idx, row in enumerate(rows, start=1):
+        if row.get("error"):
+            reply_text += f"<b>{idx}. Channel {row['channel_id']}</b> (Error: {row['error']})\n\n"
+        else:
+            reply_text += f"<b>{idx}. {row['title']} ({row['channel_id']})</b>\n"
+            reply_text += f"<b>➥ Nᴏʀᴍᴀʟ:</b> <code>{row['normal_link']}</code>\n"
+            reply_text += f"<b>➤ Rᴇǫᴜᴇsᴛ:</b> <code>{row['request_link']}</code>\n\n"
+        if len(reply_text) > MAX_MESSAGE_LENGTH:
+            break
+
+    if status_msg:
         try:
-            channel_id = int(id_str)
-            chat = await client.get_chat(channel_id)
-            base64_invite = await save_encoded_link(channel_id)
-            normal_link = f"https://t.me/{client.username}?start={base64_invite}"
-            base64_request = await encode(str(channel_id))
-            await save_encoded_link2(channel_id, base64_request)
-            request_link = f"https://t.me/{client.username}?start=req_{base64_request}"
-            reply_text += f"<b>{idx}. {chat.title} ({channel_id})</b>\n"
-            reply_text += f"<b>➥ Nᴏʀᴍᴀʟ:</b> <code>{normal_link}</code>\n"
-            reply_text += f"<b>➤ Rᴇǫᴜᴇsᴛ:</b> <code>{request_link}</code>\n\n"
-        except Exception as e:
-            reply_text += f"<b>{idx}. Channel {id_str}</b> (Error: {e})\n\n"
-    await message.reply(reply_text)
+            await status_msg.delete()
+        except:
+            pass
 
+    if len(reply_text) <= MAX_MESSAGE_LENGTH:
+        return await message.reply(reply_text)
 
+    writer = LinkFileWriter(fmt)
+    try:
+        for row in rows:
+            writer.write(row)
+        path = writer.close()
+        failed = sum(1 for row in rows if row.get("error"))
+        await message.reply_document(
+            path,
+            file_name=f"bulk_links.{fmt}",
+            caption=f"<b>➤ Bᴜʟᴋ Lɪɴᴋ Gᴇɴᴇʀᴀᴛɪᴏɴ:</b> {len(rows) - failed} ʟɪɴᴋᴇᴅ, {failed} ғᴀɪʟᴇᴅ"
+        )
+    finally:
+        if not writer.file.closed:
+            writer.file.close()
+        os.remove(writer.path)
+
+# Export every channel's links as one document
+@Bot.on_message(filters.command('exportlinks') & is_owner_or_admin)
+@offload("bulk")
+async def export_links(client: Bot, message: Message):
+    fmt = "json" if len(message.command) > 1 and message.command[1].lower() == "json" else "csv"
+    status_msg = await message.reply("<i>Exporting links...</i>")
+    writer = LinkFileWriter(fmt, fields=LINK_FILE_FIELDS[:-1] + ["original_link"])
+    try:
+        async for doc in iter_channels():
+            channel_id = doc["channel_id"]
+            normal_link, request_link = channel_deep_links(client.username, channel_id)
+            writer.write({
+                "channel_id": channel_id,
+                "title": (doc.get("chat_info") or {}).get("title", ""),
+                "normal_link": normal_link,
+                "request_link": request_link,
+                "status": doc.get("status", ""),
+                "original_link": doc.get("original_link", "")
+            })
+        path = writer.close()
+        await message.reply_document(
+            path,
+            file_name=f"channel_links.{fmt}",
+            caption=f"<b>➤ Exᴘᴏʀᴛᴇᴅ {writer.count} ᴄʜᴀɴɴᴇʟ ʟɪɴᴋs</b>"
+        )
+    except Exception as e:
+        await message.reply(f"<b>Error exporting links:</b> <code>{e}</code>")
+    finally:
+        if not writer.file.closed:
+            writer.file.close()
+        os.remove(writer.path)
+        try:
+            await status_msg.delete()
+        except:
+            pass
 
 @Bot.on_message(filters.command('genlink') & filters.private & is_owner_or_admin)
+@offload("admin")
 async def generate_link_command(client: Bot, message: Message):
     user_id = message.from_user.id
     if len(message.command) < 2:
@@ -286,9 +506,8 @@ async def generate_link_command(client: Bot, message: Message):
         sent_msg = await client.send_message(DATABASE_CHANNEL, f"#LINK\n{link}")
         channel_id = sent_msg.id  # Use id as unique id for this link
         # Save encoded links
-        base64_invite = await save_encoded_link(channel_id)
-        base64_request = await encode(str(channel_id))
-        await save_encoded_link2(channel_id, base64_request)
+        await save_encoded_link(channel_id)
+        await save_encoded_link2(channel_id, await encode(str(channel_id)))
         # Store the original link in the database
         from database.database import channels_collection
         await channels_collection.update_one(
@@ -296,8 +515,8 @@ async def generate_link_command(client: Bot, message: Message):
             {"$set": {"original_link": link}},
             upsert=True
         )
-        normal_link = f"https://t.me/{client.username}?start={base64_invite}"
-        request_link = f"https://t.me/{client.username}?start=req_{base64_request}"
+        invalidate_link_cache(channel_id)
+        normal_link, request_link = channel_deep_links(client.username, channel_id)
         reply_text = (
             f"<b>✅ Link stored and encoded successfully.</b>\n\n"
             f"<b>🔗 Normal Link:</b> <code>{normal_link}</code>\n"
@@ -308,33 +527,29 @@ async def generate_link_command(client: Bot, message: Message):
         await message.reply(f"<b>Error storing link:</b> <code>{e}</code>")
 
 @Bot.on_message(filters.command('channels') & is_owner_or_admin)
+@offload("admin")
 async def show_channel_ids(client: Bot, message: Message):
-    channels = await get_channels()
-    if not channels:
+    if not await count_channels():
         return await message.reply("<b><blockquote expandable>Nᴏ ᴄʜᴀɴɴᴇʟs ᴀʀᴇ ᴀᴠᴀɪʟᴀʙʟᴇ. Pʟᴇᴀsᴇ ᴜsᴇ /addch ᴛᴏ ᴀᴅᴅ ᴀ ᴄʜᴀɴɴᴇʟ.</b>")
     status_msg = await message.reply("<i>Please wait...</i>")
-    await send_channel_ids_page(client, message, channels, page=0, status_msg=status_msg)
+    await send_channel_ids_page(client, message, page=0, status_msg=status_msg)
 
-async def send_channel_ids_page(client, message, channels, page, status_msg=None, edit=False):
+async def send_channel_ids_page(client, message, page, direction=None, key=None, status_msg=None, edit=False):
     PAGE_SIZE = 10
-    total_pages = (len(channels) + PAGE_SIZE - 1) // PAGE_SIZE
-    start_idx = page * PAGE_SIZE
-    end_idx = start_idx + PAGE_SIZE
     text = "<b>➤ Cᴏɴɴᴇᴄᴛᴇᴅ Cʜᴀɴɴᴇʟs (ID & Name):</b>\n\n"
-    for idx, channel_id in enumerate(channels[start_idx:end_idx], start=start_idx + 1):
-        try:
-            chat = await client.get_chat(channel_id)
-            text += f"<b>{idx}. {chat.title}</b> <code>({channel_id})</code>\n"
-        except Exception as e:
+    started = time.perf_counter()
+    page_channels, page, total_pages, has_prev, has_next = await load_channel_page(page, PAGE_SIZE, direction, key)
+    infos = await fetch_chat_infos(client, page_channels)
+    for idx, channel_id in enumerate(page_channels, start=page * PAGE_SIZE + 1):
+        if channel_id in infos:
+            text += f"<b>{idx}. {infos[channel_id]['title']}</b> <code>({channel_id})</code>\n"
+        else:
             text += f"<b>{idx}. Channel {channel_id}</b> (Error)\n"
+    page_latency.record("channels", started)
     text += f"\n<b>📄 Pᴀɢᴇ {page + 1} ᴏғ {total_pages}</b>"
     # Navigation buttons
     buttons = []
-    nav_buttons = []
-    if page > 0:
-        nav_buttons.append(InlineKeyboardButton("• Pʀᴇᴠɪᴏᴜs •", callback_data=f"channelids_{page-1}"))
-    if page < total_pages - 1:
-        nav_buttons.append(InlineKeyboardButton("• Nᴇxᴛ •", callback_data=f"channelids_{page+1}"))
+    nav_buttons = page_nav_buttons("channelids", page, page_channels, has_prev, has_next)
     if nav_buttons:
         buttons.append(nav_buttons)
     reply_markup = InlineKeyboardMarkup(buttons) if buttons else None
@@ -349,7 +564,7 @@ async def send_channel_ids_page(client, message, channels, page, status_msg=None
             pass
 
 @Bot.on_callback_query(filters.regex(r"channelids_(\d+)"))
+@offload("callbacks")
 async def paginate_channel_ids(client, callback_query):
-    page = int(callback_query.data.split("_")[1])
-    channels = await get_channels()
-    await send_channel_ids_page(client, callback_query.message, channels, page, edit=True)
+    page, direction, key = parse_page_callback(callback_query.data)
+    await send_channel_ids_page(client, callback_query.message, page, direction, key, edit=True)
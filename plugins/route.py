@@ -1,7 +1,28 @@
+import hmac
 from aiohttp import web
+from broadcast import active_broadcasts
+from config import WEB_STATUS_TOKEN
+from lanes import lanes
 
 routes = web.RouteTableDef()
 
+def _authorized(request) -> bool:
+    """Status routes need WEB_STATUS_TOKEN as ?token= or an X-Status-Token header."""
+    token = request.headers.get("X-Status-Token") or request.query.get("token", "")
+    return bool(WEB_STATUS_TOKEN) and hmac.compare_digest(token.encode(), WEB_STATUS_TOKEN.encode())
+
 @routes.get("/", allow_head=True)
 async def root_route_handler(request):
     return web.json_response("Links Share Bot")
+
+@routes.get("/broadcasts", allow_head=True)
+async def broadcasts_route_handler(request):
+    if not _authorized(request):
+        raise web.HTTPNotFound()
+    return web.json_response([job.telemetry() for job in active_broadcasts.values()])
+
+@routes.get("/lanes", allow_head=True)
+async def lanes_route_handler(request):
+    if not _authorized(request):
+        raise web.HTTPNotFound()
+    return web.json_response([lane.telemetry() for lane in lanes.values()])
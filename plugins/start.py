@@ -12,15 +12,18 @@ from bot import Bot
 from datetime import datetime, timedelta
 from config import *
 from database.database import *
-from plugins.newpost import revoke_invite_after_5_minutes
+from plugins.newpost import get_pooled_invite_link, seed_pooled_invite_link, page_latency
 from helper_func import *
+from scheduler import scheduler
+from approvals import approval_queue
+from lanes import offload, lanes_status_text
+from broadcast import BroadcastJob, run_broadcast, cancel_broadcasts, pause_broadcasts, resume_broadcasts
 
 
 user_banned_until = {}
 
-# Broadcast variables
-cancel_lock = asyncio.Lock()
-is_canceled = False
+# Per-stage timings of the deep-link path (resolve -> invite -> reply)
+start_latency = LatencyTracker()
 
 @Bot.on_message(filters.command('start') & filters.private)
 async def start_command(client: Bot, message: Message):
@@ -32,8 +35,10 @@ async def start_command(client: Bot, message: Message):
                 "<b><blockquote expandable>You are temporarily banned from using commands due to spamming. Try again later.</b>",
                 parse_mode=ParseMode.HTML
             )
-            
-    await add_user(user_id)
+
+    started = time.perf_counter()
+    # Registration is write-behind; it never decides what the user sees
+    queue_user(user_id)
 # 
     # Check FSub requirements
    #  fsub_channels = await get_fsub_channels()
@@ -50,76 +55,64 @@ async def start_command(client: Bot, message: Message):
     if len(text) > 7:
         try:
             base64_string = text.split(" ", 1)[1]
-            is_request = base64_string.startswith("req_")
-            
-            if is_request:
-                base64_string = base64_string[4:]
-                channel_id = await get_channel_by_encoded_link2(base64_string)
+            signed = parse_signed_token(base64_string)
+
+            if signed:
+                channel_id, is_request = signed
+                if is_channel_revoked(channel_id):
+                    link_info = None
+                elif channel_id > 0:
+                    # /genlink entries are keyed by message id and need their stored target
+                    link_info = await resolve_channel_link(channel_id, is_request)
+                else:
+                    link_info = {"channel_id": channel_id, "is_request": is_request, "original_link": None, "invite_link": None}
             else:
-                channel_id = await get_channel_by_encoded_link(base64_string)
+                # Old base64 links stay valid through the database lookup
+                is_request = base64_string.startswith("req_")
+                if is_request:
+                    base64_string = base64_string[4:]
+                link_info = await resolve_encoded_link(base64_string, is_request)
             
-            if not channel_id:
+            if not link_info:
                 return await message.reply_text(
                     "<b><blockquote expandable>Invalid or expired invite link.</b>",
                     parse_mode=ParseMode.HTML
                 )
+            channel_id = link_info["channel_id"]
+            stage = start_latency.record("resolve", started)
 
             # Check if this is a /genlink link (original_link exists)
-            from database.database import get_original_link
-            original_link = await get_original_link(channel_id)
+            original_link = link_info["original_link"]
             if original_link:
                 button = InlineKeyboardMarkup(
                     [[InlineKeyboardButton("• Proceed to Link •", url=original_link)]]
                 )
+                incr_stat("links_issued", daily=True)
                 return await message.reply_text(
                     "<b><blockquote expandable>ʜᴇʀᴇ ɪs ʏᴏᴜʀ ʟɪɴᴋ! ᴄʟɪᴄᴋ ʙᴇʟᴏᴡ ᴛᴏ ᴘʀᴏᴄᴇᴇᴅ</b>",
                     reply_markup=button,
                     parse_mode=ParseMode.HTML
                 )
 
-            old_link_info = await get_current_invite_link(channel_id)
-            if old_link_info:
-                try:
-                    await client.revoke_chat_invite_link(channel_id, old_link_info["invite_link"])
-                    print(f"Revoked old {'request' if old_link_info['is_request'] else 'invite'} link for channel {channel_id}")
-                except Exception as e:
-                    print(f"Failed to revoke old link for channel {channel_id}: {e}")
-
-            invite = await client.create_chat_invite_link(
-                chat_id=channel_id,
-                expire_date=datetime.now() + timedelta(minutes=5),
-                creates_join_request=is_request
-            )
+            # Reuse a link minted before a restart instead of creating a fresh one
+            if link_info["invite_link"] and link_info.get("invite_link_expiry") and link_info["invite_is_request"] == is_request:
+                seed_pooled_invite_link(channel_id, is_request, link_info["invite_link"], link_info["invite_link_expiry"])
 
-            await save_invite_link(channel_id, invite.invite_link, is_request)
+            invite_link = await get_pooled_invite_link(client, channel_id, is_request)
+            stage = start_latency.record("invite", stage)
 
             button_text = "• ʀᴇǫᴜᴇsᴛ ᴛᴏ ᴊᴏɪɴ •" if is_request else "• ᴊᴏɪɴ ᴄʜᴀɴɴᴇʟ •"
-            button = InlineKeyboardMarkup([[InlineKeyboardButton(button_text, url=invite.invite_link)]])
+            button = InlineKeyboardMarkup([[InlineKeyboardButton(button_text, url=invite_link)]])
 
-            wait_msg = await message.reply_text(
-                "<b>Please wait...</b>",
-                parse_mode=ParseMode.HTML
-            )
-            
-            await asyncio.sleep(0.5)
-            
-            await wait_msg.delete()
-            
             await message.reply_text(
-                "<b><blockquote expandable>ʜᴇʀᴇ ɪs ʏᴏᴜʀ ʟɪɴᴋ! ᴄʟɪᴄᴋ ʙᴇʟᴏᴡ ᴛᴏ ᴘʀᴏᴄᴇᴇᴅ</b>",
-                reply_markup=button,
-                parse_mode=ParseMode.HTML
-            )
-
-            note_msg = await message.reply_text(
+                "<b><blockquote expandable>ʜᴇʀᴇ ɪs ʏᴏᴜʀ ʟɪɴᴋ! ᴄʟɪᴄᴋ ʙᴇʟᴏᴡ ᴛᴏ ᴘʀᴏᴄᴇᴇᴅ</blockquote></b>\n"
                 "<u><b>Note: If the link is expired, please click the post link again to get a new one.</b></u>",
+                reply_markup=button,
                 parse_mode=ParseMode.HTML
             )
-
-            # Auto-delete the note message after 5 minutes
-            asyncio.create_task(delete_after_delay(note_msg, 300))
-
-            asyncio.create_task(revoke_invite_after_5_minutes(client, channel_id, invite.invite_link, is_request))
+            start_latency.record("reply", stage)
+            incr_stat("links_issued", daily=True)
+            start_latency.record("total", started)
 
         except Exception as e:
             await message.reply_text(
@@ -205,11 +198,13 @@ async def start_command(client: Bot, message: Message):
 #         print("Skipped edit: Message content unchanged")
 
 @Bot.on_callback_query(filters.regex("close"))
+@offload("callbacks")
 async def close_callback(client: Bot, callback_query):
     await callback_query.answer()
     await callback_query.message.delete()
 
 @Bot.on_callback_query(filters.regex("check_sub"))
+@offload("callbacks")
 async def check_sub_callback(client: Bot, callback_query: CallbackQuery):
     user_id = callback_query.from_user.id
     fsub_channels = await get_fsub_channels()
@@ -248,105 +243,67 @@ async def info(client: Bot, message: Message):
     
     ping_time = (end_time - start_time) * 1000
     
-    users = await full_userbase()
+    stats = await get_stats()
     now = datetime.now()
     delta = now - client.uptime
     bottime = get_readable_time(delta.seconds)
     
+    latency = start_latency.summary()
+    latency_text = f"\n\nDeep link latency:\n{latency}" if latency else ""
+    render = page_latency.summary()
+    if render:
+        latency_text += f"\n\nListing render time:\n{render}"
+    
     await temp_msg.edit(
-        f"<b>Users: {len(users)}\n\nUptime: {bottime}\n\nPing: {ping_time:.2f} ms</b>",
+        f"<b>{format_stats(stats)}\n\nUptime: {bottime}\n\nPing: {ping_time:.2f} ms\n\n"
+        f"Scheduled actions: {scheduler.queue_depth}\n{approval_queue.summary()}\n\n"
+        f"Lanes:\n{lanes_status_text()}{latency_text}</b>",
         reply_markup=reply_markup,
         parse_mode=ParseMode.HTML
     )
 
 @Bot.on_message(filters.command('broadcast') & filters.private & is_owner_or_admin)
+@offload("bulk")
 async def send_text(client: Bot, message: Message):
-    global is_canceled
-    async with cancel_lock:
-        is_canceled = False
     mode = False
-    broad_mode = ''
     store = message.text.split()[1:]
     
     if store and len(store) == 1 and store[0] == 'silent':
         mode = True
-        broad_mode = 'Silent '
 
     if message.reply_to_message:
-        query = await full_userbase()
-        broadcast_msg = message.reply_to_message
-        total = len(query)
-        successful = 0
-        blocked = 0
-        deleted = 0
-        unsuccessful = 0
-
         pls_wait = await message.reply("<i>Broadcasting message... This will take some time.</i>", parse_mode=ParseMode.HTML)
-        bar_length = 20
-        final_progress_bar = "●" * bar_length
-        complete_msg = f"🤖 {broad_mode}Broadcast Completed ✅"
-        progress_bar = ''
-        last_update_percentage = 0
-        percent_complete = 0
-        update_interval = 0.05
-
-        for i, chat_id in enumerate(query, start=1):
-            async with cancel_lock:
-                if is_canceled:
-                    final_progress_bar = progress_bar
-                    complete_msg = f"🤖 {broad_mode}Broadcast Canceled ❌"
-                    break
-            try:
-                await broadcast_msg.copy(chat_id, disable_notification=mode)
-                successful += 1
-            except FloodWait as e:
-                await asyncio.sleep(e.value)
-                await broadcast_msg.copy(chat_id, disable_notification=mode)
-                successful += 1
-            except UserIsBlocked:
-                await del_user(chat_id)
-                blocked += 1
-            except InputUserDeactivated:
-                await del_user(chat_id)
-                deleted += 1
-            except:
-                unsuccessful += 1
-
-            percent_complete = i / total
-
-            if percent_complete - last_update_percentage >= update_interval or last_update_percentage == 0:
-                num_blocks = int(percent_complete * bar_length)
-                progress_bar = "●" * num_blocks + "○" * (bar_length - num_blocks)
-    
-                status_update = f"""<b>🤖 {broad_mode}Broadcast in Progress...
-
-Progress: [{progress_bar}] {percent_complete:.0%}
-
-Total Users: {total}
-Successful: {successful}
-Blocked Users: {blocked}
-Deleted Accounts: {deleted}
-Unsuccessful: {unsuccessful}</b>
-
-<i>To stop the broadcast, use: /cancel</i>"""
-                await pls_wait.edit(status_update, parse_mode=ParseMode.HTML)
-                last_update_percentage = percent_complete
-
-        final_status = f"""<b>{complete_msg}
-
-Progress: [{final_progress_bar}] {percent_complete:.0%}
-
-Total Users: {total}
-Successful: {successful}
-Blocked Users: {blocked}
-Deleted Accounts: {deleted}
-Unsuccessful: {unsuccessful}</b>"""
-        return await pls_wait.edit(final_status, parse_mode=ParseMode.HTML)
+        job = await BroadcastJob.create(client, message.reply_to_message, pls_wait, silent=mode)
+        if not job:
+            return await pls_wait.edit("<b>❌ Failed to create the broadcast job.</b>", parse_mode=ParseMode.HTML)
+        # Progress, checkpoints and the final report are handled by the job itself;
+        # run it in the background so this bulk lane worker is free again
+        asyncio.create_task(run_broadcast(job))
 
     else:
         msg = await message.reply(REPLY_ERROR, parse_mode=ParseMode.HTML)
-        await asyncio.sleep(8)
-        await msg.delete()
+        await scheduler.schedule("delete_message", 8, chat_id=msg.chat.id, message_id=msg.id)
+
+@Bot.on_message(filters.command('cancel') & filters.private & is_owner_or_admin)
+async def cancel_broadcast(client: Bot, message: Message):
+    canceled = await cancel_broadcasts()
+    if not canceled:
+        return await message.reply("<b>No broadcast is running.</b>", parse_mode=ParseMode.HTML)
+    await message.reply("<b>Broadcast will stop after the messages already in flight.</b>", parse_mode=ParseMode.HTML)
+
+@Bot.on_message(filters.command('pausebroadcast') & filters.private & is_owner_or_admin)
+async def pause_broadcast(client: Bot, message: Message):
+    if not await pause_broadcasts():
+        return await message.reply("<b>No broadcast is running.</b>", parse_mode=ParseMode.HTML)
+    await message.reply("<b>⏸ Broadcast will pause once every worker finishes its current batch.</b>", parse_mode=ParseMode.HTML)
+
+@Bot.on_message(filters.command('resumebroadcast') & filters.private & is_owner_or_admin)
+async def resume_broadcast(client: Bot, message: Message):
+    job_id = message.command[1] if len(message.command) > 1 else None
+    resumed = await resume_broadcasts(client, job_id, statuses=("paused",))
+    if not resumed:
+        return await message.reply("<b>No paused broadcast found.</b>", parse_mode=ParseMode.HTML)
+    await message.reply("<b>▶️ Broadcast resumed from its last checkpoint.</b>", parse_mode=ParseMode.HTML)
 
 user_message_count = {}
 user_banned_until = {}
@@ -392,6 +349,7 @@ async def monitor_messages(client: Bot, message: Message):
 """
 
 @Bot.on_callback_query()
+@offload("callbacks")
 async def cb_handler(client: Bot, query: CallbackQuery):
     data = query.data  
     chat_id = query.message.chat.id
@@ -450,12 +408,3 @@ async def cb_handler(client: Bot, query: CallbackQuery):
                 reply_markup=inline_buttons,
                 parse_mode=ParseMode.HTML
             )
-
-def delete_after_delay(msg, delay):
-    async def inner():
-        await asyncio.sleep(delay)
-        try:
-            await msg.delete()
-        except:
-            pass
-    return inner()
@@ -3,7 +3,8 @@ from pyrogram.types import Message
 from pyrogram import filters
 from config import OWNER_ID, BOT_STATS_TEXT, USER_REPLY_TEXT
 from datetime import datetime
-from helper_func import get_readable_time
+from helper_func import get_readable_time, format_stats
+from database.database import get_stats
 
 """
 @Bot.on_message(filters.private & filters.incoming)
@@ -18,4 +19,5 @@ async def stats(bot: Bot, message: Message):
     now = datetime.now()
     delta = now - bot.uptime
     time = get_readable_time(delta.seconds)
-    await message.reply(BOT_STATS_TEXT.format(uptime=time))
+    stats = await get_stats()
+    await message.reply(BOT_STATS_TEXT.format(uptime=time) + f"\n\n<b>{format_stats(stats)}</b>")
@@ -0,0 +1,108 @@
+import asyncio
+import heapq
+import itertools
+from collections import defaultdict
+from datetime import datetime, timedelta
+from database.database import save_pending_action, get_pending_actions, delete_pending_actions
+
+SCHEDULER_BATCH_SIZE = 100
+
+
+async def _revoke_links(client, payloads):
+    async def revoke(payload):
+        try:
+            await client.revoke_chat_invite_link(payload["chat_id"], payload["invite_link"])
+            print(f"Revoked {'request' if payload.get('is_request') else 'invite'} link for channel {payload['chat_id']}")
+        except Exception as e:
+            print(f"Failed to revoke invite for channel {payload['chat_id']}: {e}")
+    await asyncio.gather(*(revoke(payload) for payload in payloads))
+
+
+async def _delete_messages(client, payloads):
+    by_chat = defaultdict(list)
+    for payload in payloads:
+        by_chat[payload["chat_id"]].append(payload["message_id"])
+    for chat_id, message_ids in by_chat.items():
+        try:
+            await client.delete_messages(chat_id, message_ids)
+        except Exception as e:
+            print(f"Failed to delete messages in {chat_id}: {e}")
+
+
+class ActionScheduler:
+    """Single timer for delayed actions (invite revocations, message deletions).
+
+    Due times live in a min-heap; every action is also stored in the
+    `pending_actions` collection, so a restart reloads and fires them instead
+    of leaving links alive.
+    """
+
+    def __init__(self):
+        self.handlers = {
+            "revoke_link": _revoke_links,
+            "delete_message": _delete_messages,
+        }
+        self._heap = []
+        self._seq = itertools.count()
+        self._wakeup = None
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._heap)
+
+    def _push(self, due_at: datetime, action_id, kind: str, payload: dict):
+        is_next = not self._heap or due_at < self._heap[0][0]
+        heapq.heappush(self._heap, (due_at, next(self._seq), action_id, kind, payload))
+        if is_next and self._wakeup:
+            self._wakeup.set()
+
+    async def schedule(self, kind: str, delay: float, **payload):
+        """Run `kind` with `payload` after `delay` seconds."""
+        due_at = datetime.utcnow() + timedelta(seconds=delay)
+        action_id = await save_pending_action(kind, due_at, payload)
+        self._push(due_at, action_id, kind, payload)
+
+    async def load(self) -> int:
+        """Reload actions persisted by a previous run."""
+        actions = await get_pending_actions()
+        for action in actions:
+            self._push(action["due_at"], action["_id"], action["kind"], action.get("payload", {}))
+        return len(actions)
+
+    async def run(self, client):
+        self._wakeup = asyncio.Event()
+        while True:
+            timeout = None
+            if self._heap:
+                timeout = max((self._heap[0][0] - datetime.utcnow()).total_seconds(), 0)
+            if timeout != 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+
+            now = datetime.utcnow()
+            due = []
+            while self._heap and self._heap[0][0] <= now and len(due) < SCHEDULER_BATCH_SIZE:
+                due.append(heapq.heappop(self._heap))
+            if due:
+                await self._fire(client, due)
+
+    async def _fire(self, client, due):
+        by_kind = defaultdict(list)
+        for _, _, _, kind, payload in due:
+            by_kind[kind].append(payload)
+        for kind, payloads in by_kind.items():
+            handler = self.handlers.get(kind)
+            if not handler:
+                print(f"No handler for scheduled action {kind}, dropping {len(payloads)}")
+                continue
+            try:
+                await handler(client, payloads)
+            except Exception as e:
+                print(f"Error running scheduled {kind} actions: {e}")
+        await delete_pending_actions([action_id for _, _, action_id, _, _ in due if action_id is not None])
+
+
+scheduler = ActionScheduler()
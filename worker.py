@@ -0,0 +1,38 @@
+import asyncio
+import socket
+from pyrogram import Client
+import pyrogram.utils
+from config import API_HASH, APP_ID, TG_BOT_TOKEN, LOGGER, BROADCAST_WORKER_NAME
+from broadcast import work_on_broadcasts_forever, WORKER_ID
+from database.database import run_stats_flusher, flush_stats
+
+pyrogram.utils.MIN_CHANNEL_ID = -1009147483647
+
+# Extra broadcast sender: run as many of these as you like next to main.py.
+# They only claim broadcast partitions; updates are still handled by the main bot.
+
+
+async def main():
+    # A persistent session keeps the users it has resolved, so later broadcasts
+    # don't pay a users.GetUsers lookup per recipient again
+    client = Client(
+        name=f"BroadcastWorker-{BROADCAST_WORKER_NAME or socket.gethostname()}",
+        api_hash=API_HASH,
+        api_id=APP_ID,
+        bot_token=TG_BOT_TOKEN,
+        no_updates=True,
+    )
+    await client.start()
+    LOGGER(__name__).info(f"Broadcast worker {WORKER_ID} started")
+    # Dead-user prunes decrement total_users through the buffered counters
+    flusher = asyncio.create_task(run_stats_flusher())
+    try:
+        await work_on_broadcasts_forever(client)
+    finally:
+        flusher.cancel()
+        await flush_stats()
+        await client.stop()
+
+
+if __name__ == "__main__":
+    asyncio.get_event_loop().run_until_complete(main())